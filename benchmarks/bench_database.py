@@ -0,0 +1,299 @@
+"""Задержки и число запросов публичных функций db.database на базе объёмом в учебный год.
+
+python -m benchmarks.bench_database [--users 1000] [--days 200] [--lessons 8] [--iterations 200]
+                                    [--cold] [--output bench_database.json] [--compare old.json]
+Заполняет базу (benchmarks/seed.py), вызывает каждую функцию --iterations раз для случайных
+пользователей и дней и пишет p50/p99 и число запросов на вызов в JSON. С --compare печатает,
+во сколько раз изменилась p50 относительно прошлого результата.
+По умолчанию база - временный файл sqlite, BENCH_DB_URL позволяет указать отдельную пустую базу Postgres.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from benchmarks.seed import FIRST_TG_ID, SUBJECTS, class_of, seed, seed_dates
+from db import database
+from db.core import init_db, get_session_maker
+
+
+def percentile(timings: list, p: float) -> float:
+    return timings[min(int(len(timings) * p), len(timings) - 1)]
+
+
+def make_calls(users: int, days: int, lessons: int) -> dict:
+    dates = seed_dates(days)
+    new_tg_ids = iter(range(1, 10 ** 9))
+    reminder_ids = iter(range(1, 10 ** 9))
+
+    def random_day():
+        day = random.randrange(days)
+        user_id = random.randint(1, users)
+        # в сиде предмет урока number в день day - SUBJECTS[(day + number) % len(SUBJECTS)]
+        return FIRST_TG_ID + user_id, user_id, day, dates[day].strftime("%d.%m.%Y")
+
+    def user_day():
+        tg_id, _, _, date_str = random_day()
+        return tg_id, date_str
+
+    def week(day: int) -> list:
+        return [
+            {
+                "date": dates[d].strftime("%d.%m.%Y"),
+                "lessons": [
+                    {
+                        "lesson": SUBJECTS[(d + number) % len(SUBJECTS)],
+                        "classroom": str(100 + number),
+                        "lesson_number": number,
+                        "load_level": 5
+                    }
+                    for number in range(1, lessons + 1)
+                ]
+            }
+            for d in range(day, min(day + 7, days))
+        ]
+
+    async def import_week(session):
+        tg_id, _, day, _ = random_day()
+        await database.import_schedule_from_json(session, tg_id, week(day))
+
+    async def add_homework(session):
+        tg_id, _, day, date_str = random_day()
+        await database.add_homework(session, tg_id, date_str, SUBJECTS[(day + 1) % len(SUBJECTS)], "упр. 6")
+
+    async def edit_schedule(session):
+        # замены на весь день, как их присылает модель, часть - на ещё не известные предметы
+        tg_id, _, day, date_str = random_day()
+        await database.edit_schedule(session, tg_id, [
+            {
+                "date": date_str,
+                "subject_from": SUBJECTS[(day + number) % len(SUBJECTS)],
+                "subject_to": f"замена {number}" if number % 2 else "---"
+            }
+            for number in range(1, min(lessons, len(SUBJECTS)))
+        ])
+
+    async def get_day_loads(session):
+        tg_id, _, day, date_str = random_day()
+        await database.get_day_loads(session, tg_id, date_str, dates[min(day + 6, days - 1)].strftime("%d.%m.%Y"))
+
+    async def refresh_day_loads(session):
+        _, user_id, day, _ = random_day()
+        await database.refresh_day_loads(session, class_of(user_id), [dates[day]])
+
+    async def refresh_user_day_loads(session):
+        _, user_id, day, _ = random_day()
+        await database.refresh_user_day_loads(session, [dates[day]], user_id=user_id)
+
+    async def get_day_lessons(session):
+        tg_id, _, day, _ = random_day()
+        await database.get_day_lessons(session, tg_id, dates[day])
+
+    async def get_schedule_by_range(session):
+        tg_id, _, day, date_str = random_day()
+        await database.get_schedule_by_range(session, tg_id, date_str, dates[min(day + 6, days - 1)])
+
+    async def get_homework_by_range(session):
+        tg_id, _, day, date_str = random_day()
+        await database.get_homework_by_range(session, tg_id, date_str, dates[min(day + 6, days - 1)])
+
+    async def iter_schedule_by_range(session):
+        # вся четверть, как "расписание на четверть"
+        tg_id, _, day, date_str = random_day()
+        async for _ in database.iter_schedule_by_range(session, tg_id, date_str, dates[min(day + 60, days - 1)]):
+            pass
+
+    async def get_lessons_by_dates(session):
+        tg_id, _, day, _ = random_day()
+        await database.get_lessons_by_dates(session, tg_id, dates[day:day + 7])
+
+    async def find_subject_ids(session):
+        _, user_id, _, _ = random_day()
+        await database.find_subject_ids(session, user_id, class_of(user_id), random.sample(SUBJECTS, 3))
+
+    async def find_subject_id(session):
+        _, user_id, day, _ = random_day()
+        await database.find_subject_id(session, user_id, class_of(user_id), SUBJECTS[day % len(SUBJECTS)])
+
+    async def lesson_not_found(session):
+        _, user_id, _, date_str = random_day()
+        await database.lesson_not_found(session, user_id, class_of(user_id), "черчение", date_str)
+
+    async def add_reminder(session):
+        tg_id, *_ = random_day()
+        await database.add_reminder(session, tg_id, datetime.now() + timedelta(hours=1), f"текст {next(reminder_ids)}")
+
+    return {
+        "get_user_id": lambda s: database.get_user_id(s, random_day()[0]),
+        "create_user": lambda s: database.create_user(s, next(new_tg_ids), "9А", "школа 1"),
+        "get_user_grade": lambda s: database.get_user_grade(s, random_day()[0]),
+        "get_schedule_by_date": lambda s: database.get_schedule_by_date(s, *user_day()),
+        "get_lesson_by_date_and_number": lambda s: database.get_lesson_by_date_and_number(
+            s, *user_day(), random.randint(1, lessons)),
+        "import_schedule_from_json": import_week,
+        "get_all_user_subjects": lambda s: database.get_all_user_subjects(s, random_day()[0]),
+        "add_homework": add_homework,
+        "get_homework_by_date": lambda s: database.get_homework_by_date(s, *user_day()),
+        "get_schedule_by_range": get_schedule_by_range,
+        "get_homework_by_range": get_homework_by_range,
+        "iter_schedule_by_range": iter_schedule_by_range,
+        "get_average_load_level": lambda s: database.get_average_load_level(s, *user_day()),
+        "get_day_view": lambda s: database.get_day_view(s, *user_day()),
+        "get_day_loads": get_day_loads,
+        "refresh_day_loads": refresh_day_loads,
+        "refresh_user_day_loads": refresh_user_day_loads,
+        "get_user_ids": lambda s: database.get_user_ids(s, random_day()[0]),
+        "get_class_id": lambda s: database.get_class_id(s, f"{class_of(random.randint(1, users))}А", "школа 1"),
+        "get_day_lessons": get_day_lessons,
+        "get_lessons_by_dates": get_lessons_by_dates,
+        "find_subject_id": find_subject_id,
+        "find_subject_ids": find_subject_ids,
+        "lesson_not_found": lesson_not_found,
+        "edit_schedule": edit_schedule,
+        "add_reminder": add_reminder,
+        "get_pending_reminders": lambda s: database.get_pending_reminders(s, datetime.now() + timedelta(hours=1)),
+        "claim_reminders": lambda s: database.claim_reminders(
+            s, random.sample(range(1, 10_000), 50), timedelta(minutes=15)),
+        "release_reminder": lambda s: database.release_reminder(s, random.randint(1, 10_000)),
+        "mark_reminder_sent": lambda s: database.mark_reminder_sent(s, random.randint(1, 10_000)),
+        "add_outbox_message": lambda s: database.add_outbox_message(s, "notifications", {"text": "текст"}),
+        "get_unpublished_outbox": lambda s: database.get_unpublished_outbox(s, 100),
+        "mark_outbox_published": lambda s: database.mark_outbox_published(s, random.sample(range(1, 10_000), 50)),
+    }
+
+
+async def bench(session_maker, counter: dict, call, iterations: int, cold: bool) -> dict:
+    timings = []
+    queries = 0
+    errors = 0
+    for _ in range(iterations):
+        if cold:
+            database.subjects_cache.clear()
+            database.user_ids_cache.clear()
+        async with session_maker() as session:
+            counter["n"] = 0
+            started = time.perf_counter()
+            try:
+                await call(session)
+            except ValueError:
+                # случайный день мог уже измениться предыдущими вызовами
+                errors += 1
+            timings.append(time.perf_counter() - started)
+            queries += counter["n"]
+
+    timings.sort()
+    return {
+        "calls": iterations,
+        "errors": errors,
+        "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "queries_per_call": round(queries / iterations, 2),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, path: str):
+    with open(path, encoding="utf-8") as f:
+        old = json.load(f)["results"]
+
+    for name, result in results.items():
+        if name not in old:
+            continue
+        ratio = result["p50_ms"] / old[name]["p50_ms"] if old[name]["p50_ms"] else float("inf")
+        print(
+            f"{name:30} p50 {old[name]['p50_ms']:8.3f} -> {result['p50_ms']:8.3f}ms (x{ratio:.2f}) "
+            f"queries {old[name]['queries_per_call']} -> {result['queries_per_call']}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=200)
+    parser.add_argument("--lessons", type=int, default=8)
+    parser.add_argument("--reminders", type=int, default=10_000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--only", nargs="*", help="имена функций, которые нужно измерить")
+    parser.add_argument("--cold", action="store_true", help="сбрасывать кэши db.database перед каждым вызовом")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_database.json")
+    parser.add_argument("--compare", help="прошлый результат для сравнения")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = await init_db(os.getenv("BENCH_DB_URL", f"sqlite+aiosqlite:///{tmp}/bench.db"))
+        session_maker = get_session_maker(engine)
+        backend = engine.url.get_backend_name()
+
+        print(f"seeding users={args.users} days={args.days} lessons={args.lessons} db={backend}")
+        started = time.perf_counter()
+        await seed(session_maker, args.users, args.days, args.lessons, args.reminders)
+        print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+        counter = {"n": 0}
+        event.listen(engine.sync_engine, "before_cursor_execute",
+                     lambda *_: counter.__setitem__("n", counter["n"] + 1))
+
+        calls = make_calls(args.users, args.days, args.lessons)
+        public = {
+            name for name, func in inspect.getmembers(database, inspect.iscoroutinefunction)
+            if func.__module__ == database.__name__ and not name.startswith("_")
+        }
+        for name in sorted(public - set(calls)):
+            print(f"{name}: нет вызова в bench_database, пропущено")
+
+        results = {}
+        for name, call in calls.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = await bench(session_maker, counter, call, args.iterations, args.cold)
+            result = results[name]
+            print(
+                f"{name:30} p50={result['p50_ms']:8.3f}ms p99={result['p99_ms']:8.3f}ms "
+                f"queries/call={result['queries_per_call']:5} errors={result['errors']}"
+            )
+
+        await engine.dispose()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "db": backend,
+            "users": args.users,
+            "days": args.days,
+            "lessons": args.lessons,
+            "reminders": args.reminders,
+            "iterations": args.iterations,
+            "cold": args.cold,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
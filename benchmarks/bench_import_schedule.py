@@ -0,0 +1,123 @@
+"""Сравнение построчного и bulk импорта расписания.
+
+python -m benchmarks.bench_import_schedule [--users 50] [--days 15] [--lessons 8]
+По умолчанию база - sqlite в памяти, BENCH_DB_URL позволяет указать отдельную пустую базу
+в локальном Postgres.
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import event, select
+
+from db.core import init_db, get_session_maker
+from db.database import create_user, import_schedule_from_json, parse_date, refresh_day_loads
+from db.models import Schedule, Subject, User
+
+SUBJECTS = ["алгебра", "геомет", "рус.яз", "литер", "физика", "химия", "биолог", "англ.яз", "история", "физ-ра"]
+
+
+def make_schedule(days: int, lessons: int) -> list:
+    start = date(2025, 9, 1)
+    return [
+        {
+            "date": (start + timedelta(days=day)).strftime("%d.%m.%Y"),
+            "lessons": [
+                {
+                    "lesson": SUBJECTS[(day + number) % len(SUBJECTS)],
+                    "classroom": str(100 + number),
+                    "lesson_number": number,
+                    "load_level": 5
+                }
+                for number in range(1, lessons + 1)
+            ]
+        }
+        for day in range(days)
+    ]
+
+
+async def import_rowwise(session, tg_id: int, schedule_data: list):
+    # построчный импорт в том виде, в каком он был до bulk upsert, но в расписание класса
+    user = (await session.execute(select(User).filter_by(tg_id=tg_id))).scalar_one()
+
+    for day_data in schedule_data:
+        date_obj = parse_date(day_data['date'])
+        for lesson_data in day_data['lessons']:
+            subject_name = lesson_data['lesson']
+            classroom = lesson_data['classroom'] or None
+            load_level = lesson_data.get('load_level', 5)
+
+            subject = (await session.execute(
+                select(Subject).filter_by(class_id=user.class_id, name=subject_name)
+            )).scalar_one_or_none()
+            if not subject:
+                subject = Subject(class_id=user.class_id, name=subject_name, classroom=classroom, load_level=load_level)
+                session.add(subject)
+                await session.flush()
+
+            schedule_entry = (await session.execute(
+                select(Schedule).filter_by(class_id=user.class_id, date=date_obj,
+                                           lesson_number=lesson_data['lesson_number'])
+            )).scalar_one_or_none()
+            if not schedule_entry:
+                session.add(Schedule(class_id=user.class_id, date=date_obj,
+                                     lesson_number=lesson_data['lesson_number'], subject_id=subject.id))
+            else:
+                schedule_entry.subject_id = subject.id
+
+    await session.flush()
+    await refresh_day_loads(session, user.class_id)
+    await session.commit()
+
+
+async def run(name, import_func, session_maker, counter, users: int, schedule_data: list, first_tg_id: int,
+              school: str):
+    timings = []
+    queries = 0
+    for tg_id in range(first_tg_id, first_tg_id + users):
+        async with session_maker() as session:
+            await create_user(session, tg_id, "9А", school)
+        # второй проход - повторная загрузка того же файла, как при обновлении расписания
+        for _ in range(2):
+            async with session_maker() as session:
+                counter["n"] = 0
+                started = time.perf_counter()
+                await import_func(session, tg_id, schedule_data)
+                timings.append(time.perf_counter() - started)
+                queries += counter["n"]
+
+    timings.sort()
+    print(
+        f"{name:8} imports={len(timings)} total={sum(timings):.3f}s "
+        f"p50={timings[len(timings) // 2] * 1000:.1f}ms max={timings[-1] * 1000:.1f}ms "
+        f"queries/import={queries / len(timings):.1f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--days", type=int, default=15)
+    parser.add_argument("--lessons", type=int, default=8)
+    args = parser.parse_args()
+
+    engine = await init_db(os.getenv("BENCH_DB_URL", "sqlite+aiosqlite:///:memory:"))
+    counter = {"n": 0}
+    event.listen(engine.sync_engine, "before_cursor_execute",
+                 lambda *_: counter.__setitem__("n", counter["n"] + 1))
+    session_maker = get_session_maker(engine)
+    schedule_data = make_schedule(args.days, args.lessons)
+
+    print(f"users={args.users} days={args.days} lessons={args.lessons} db={engine.url.get_backend_name()}")
+    # у вариантов разные школы, чтобы второй не начинал с уже заполненного расписания класса
+    await run("rowwise", import_rowwise, session_maker, counter, args.users, schedule_data, 1, "школа 1")
+    await run("bulk", import_schedule_from_json, session_maker, counter, args.users, schedule_data, 1_000_000,
+              "школа 2")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,178 @@
+"""Сравнение потокового парсера расписания с прежним парсером на pandas.
+
+python -m benchmarks.bench_parse_excel [--sheets 15 30 60] [--classes 30] [--grade 9А]
+Генерирует книгу с нужным числом листов, проверяет, что результаты совпадают,
+и печатает время и пиковую память (tracemalloc) обоих вариантов.
+"""
+import argparse
+import re
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from io import BytesIO
+
+import pandas as pd
+from openpyxl import Workbook
+
+from parse_files.parse_excel import LOAD_LEVELS, parse_schedule_excel
+
+GRADES = [f"{number}{letter}" for number in range(5, 12) for letter in "АБВГ"]
+SUBJECTS = [name for name in LOAD_LEVELS if name != "---"]
+
+
+def make_workbook(sheets: int, classes: int, lessons: int = 8) -> bytes:
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    start = date(2025, 9, 1)
+    for sheet_idx in range(sheets):
+        sheet = workbook.create_sheet(f"Лист{sheet_idx + 1}")
+        day = start + timedelta(days=sheet_idx)
+        sheet.append([None, f"Расписание уроков на {day.strftime('%d.%m.%Y')}"])
+        sheet.append([])
+        sheet.append(["Класс"] + list(range(1, lessons + 1)))
+        for class_idx in range(classes):
+            grade = GRADES[class_idx % len(GRADES)]
+            row = [grade]
+            for lesson in range(lessons):
+                if (class_idx + lesson + sheet_idx) % 7 == 6:
+                    row.append("---")
+                else:
+                    subject = SUBJECTS[(class_idx * 3 + lesson + sheet_idx) % len(SUBJECTS)]
+                    row.append(f"{subject}\n{100 + lesson}")
+            sheet.append(row)
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def parse_schedule_excel_pandas(file_path, class_number):
+    # прежняя реализация: pd.ExcelFile + pd.read_excel на каждый лист и поиск через iloc
+    def clean_cell_value(value):
+        if pd.isna(value) or value in ['---', '----', '-----', '', ' ']:
+            return None
+        return str(value).strip()
+
+    def extract_lesson_info(cell_value):
+        if not cell_value:
+            return None, None
+        parts = cell_value.split('\n')
+        if len(parts) >= 2:
+            return parts[0].strip(), parts[1].strip()
+        return cell_value, None
+
+    def get_load_level(lesson_name):
+        if not lesson_name or lesson_name == "---":
+            return 0
+        return LOAD_LEVELS.get(lesson_name, 5)
+
+    def extract_date_from_sheet(df):
+        for i in range(min(10, len(df))):
+            for col in df.columns:
+                cell = df.iloc[i][col]
+                if isinstance(cell, datetime):
+                    return cell.strftime('%d.%m.%Y')
+                cell_str = str(cell)
+                if 'на' in cell_str.lower() and ('2025' in cell_str or '2024' in cell_str):
+                    date_match = re.search(r'(\d{4}[-/]\d{2}[-/]\d{2}|\d{2}\.\d{2}\.\d{4})', cell_str)
+                    if date_match:
+                        date_str = date_match.group(1)
+                        try:
+                            if '-' in date_str:
+                                date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+                            else:
+                                date_obj = datetime.strptime(date_str, '%d.%m.%Y')
+                            return date_obj.strftime('%d.%m.%Y')
+                        except ValueError:
+                            pass
+        return None
+
+    excel_file = pd.ExcelFile(file_path)
+    results = []
+    for sheet_name in excel_file.sheet_names:
+        if sheet_name == 'Лист15':
+            continue
+        if hasattr(file_path, "seek"):
+            file_path.seek(0)
+        df = pd.read_excel(file_path, sheet_name=sheet_name, header=None)
+
+        date_str = extract_date_from_sheet(df)
+        if not date_str:
+            continue
+
+        header_row = None
+        for i in range(min(15, len(df))):
+            if 'класс' in str(df.iloc[i][0]).lower():
+                header_row = i
+                break
+        if header_row is None:
+            continue
+
+        class_row = None
+        for i in range(header_row + 1, len(df)):
+            cell_value = clean_cell_value(df.iloc[i][0])
+            if cell_value and class_number in cell_value:
+                class_row = i
+                break
+        if class_row is None:
+            continue
+
+        lessons = []
+        max_lesson_number = 0
+        for col_idx in range(1, len(df.columns)):
+            cell_value = clean_cell_value(df.iloc[class_row][col_idx])
+            if cell_value:
+                lesson_name, _ = extract_lesson_info(cell_value)
+                if lesson_name:
+                    max_lesson_number = max(max_lesson_number, col_idx)
+
+        for col_idx in range(1, max_lesson_number + 1):
+            cell_value = clean_cell_value(df.iloc[class_row][col_idx])
+            if cell_value:
+                lesson_name, classroom = extract_lesson_info(cell_value)
+                lessons.append({
+                    "lesson": lesson_name if lesson_name else "---",
+                    "classroom": classroom if classroom else "",
+                    "lesson_number": col_idx,
+                    "load_level": get_load_level(lesson_name)
+                })
+            else:
+                lessons.append({"lesson": "---", "classroom": "", "lesson_number": col_idx, "load_level": 0})
+
+        if lessons:
+            results.append({"date": date_str, "lessons": lessons})
+
+    return results
+
+
+def measure(func, content: bytes, grade: str):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func(BytesIO(content), grade)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sheets", type=int, nargs="+", default=[15, 30, 60])
+    parser.add_argument("--classes", type=int, default=30)
+    parser.add_argument("--grade", default="9А")
+    args = parser.parse_args()
+
+    for sheets in args.sheets:
+        content = make_workbook(sheets, args.classes)
+        old, old_time, old_peak = measure(parse_schedule_excel_pandas, content, args.grade)
+        new, new_time, new_peak = measure(parse_schedule_excel, content, args.grade)
+        assert old == new, f"результаты различаются на книге из {sheets} листов"
+
+        print(
+            f"sheets={sheets:3} size={len(content) / 1024:.0f}KiB | "
+            f"pandas {old_time * 1000:7.1f}ms peak={old_peak / 2 ** 20:6.1f}MiB | "
+            f"streaming {new_time * 1000:7.1f}ms peak={new_peak / 2 ** 20:6.1f}MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
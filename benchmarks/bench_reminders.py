@@ -0,0 +1,111 @@
+"""Память и накладные расходы таймеров при 100k ожидающих напоминаний.
+
+python -m benchmarks.bench_reminders [--reminders 100000] [--window 3600]
+Сравнивает прежнюю схему (по задаче с asyncio.sleep на каждое напоминание)
+с ReminderScheduler: одна куча и один таймер, в памяти только ближайшее окно.
+База - временный файл sqlite, BENCH_DB_URL позволяет указать отдельную пустую базу Postgres.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench-token-not-used-for-requests")
+
+from db.core import init_db, get_session_maker
+from db.database import reminder_dedup_key
+from db.models import Reminder
+from notify_users import Delivery, ReminderScheduler
+
+
+async def loop_lag(duration: float = 1.0, interval: float = 0.01) -> float:
+    lags = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+    return sum(lags) / len(lags) * 1000
+
+
+def report(name: str, setup: float, peak: int, timers: int, lag: float, in_memory: int):
+    print(
+        f"{name:22} setup={setup:6.2f}s peak={peak / 2 ** 20:7.1f}MiB "
+        f"in_memory={in_memory:7} loop_timers={timers:7} loop_lag={lag:.3f}ms"
+    )
+
+
+async def bench_tasks(delays: list[float]):
+    loop = asyncio.get_running_loop()
+    tracemalloc.start()
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(asyncio.sleep(delay)) for delay in delays]
+    await asyncio.sleep(0)
+    setup = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lag = await loop_lag()
+    report("task per reminder", setup, peak, len(loop._scheduled), lag, len(tasks))
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def bench_scheduler(session_maker, window: timedelta, name: str):
+    loop = asyncio.get_running_loop()
+
+    async def send(tg_id, text):
+        pass
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    scheduler = ReminderScheduler(session_maker, Delivery(session_maker, send), window=window)
+    await scheduler.start()
+    await asyncio.sleep(0)
+    setup = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lag = await loop_lag()
+    report(name, setup, peak, len(loop._scheduled), lag, len(scheduler.heap))
+    await scheduler.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reminders", type=int, default=100_000)
+    parser.add_argument("--window", type=int, default=3600)
+    args = parser.parse_args()
+
+    # напоминания равномерно на ближайшие 7 дней, начиная через минуту
+    now = datetime.now()
+    remind_at = [now + timedelta(seconds=60 + i * 7 * 86400 / args.reminders) for i in range(args.reminders)]
+
+    await bench_tasks([(at - now).total_seconds() for at in remind_at])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = os.getenv("BENCH_DB_URL", f"sqlite+aiosqlite:///{tmp}/reminders.db")
+        engine = await init_db(url)
+        session_maker = get_session_maker(engine)
+        async with session_maker() as session:
+            rows = [
+                {"dedup_key": reminder_dedup_key(i, at, "текст"), "tg_id": i, "remind_at": at, "text": "текст"}
+                for i, at in enumerate(remind_at)
+            ]
+            for i in range(0, len(rows), 5000):
+                await session.execute(insert(Reminder), rows[i:i + 5000])
+            await session.commit()
+
+        await bench_scheduler(session_maker, timedelta(seconds=args.window), f"heap, window={args.window}s")
+        await bench_scheduler(session_maker, timedelta(days=8), "heap, all in memory")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
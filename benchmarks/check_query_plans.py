@@ -0,0 +1,178 @@
+"""Проверка, что запросы db/database.py идут по индексам, а не перебором таблиц.
+
+python -m benchmarks.check_query_plans [--users 1000] [--days 170] [--lessons 7] [--reminders 100000]
+Заполняет базу объёмом учебного года (benchmarks/seed.py), вызывает каждую публичную функцию
+db.database, перехватывает её SQL и выполняет для него EXPLAIN. Завершается с кодом 1,
+если хоть один запрос перебирает одну из больших таблиц.
+По умолчанию база - временный файл sqlite, BENCH_DB_URL позволяет указать отдельную пустую базу Postgres.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from benchmarks.seed import FIRST_TG_ID, SUBJECTS, class_of, seed, seed_dates
+from db import database
+from db.core import init_db, get_session_maker
+
+SEEDED_TABLES = {"classes", "users", "subjects", "schedule", "homework", "day_loads", "reminders", "outbox"}
+
+
+def calls(users: int, days: int) -> list:
+    user_id = users // 2
+    class_id = class_of(user_id)
+    tg_id = FIRST_TG_ID + user_id
+    day = days // 2
+    date_obj = seed_dates(days)[day]
+    date_str = date_obj.strftime("%d.%m.%Y")
+    week_end = seed_dates(days + 7)[day + 6].strftime("%d.%m.%Y")
+    # предмет первого урока в этот день и предмет, которого в этот день нет
+    first_subject = SUBJECTS[(day + 1) % len(SUBJECTS)]
+    second_subject = SUBJECTS[(day + 2) % len(SUBJECTS)]
+    free_subject = SUBJECTS[(day + len(SUBJECTS) - 1) % len(SUBJECTS)]
+    now = datetime.now()
+
+    return [
+        ("get_user_id", lambda s: database.get_user_id(s, tg_id)),
+        ("create_user", lambda s: database.create_user(s, 1, "9А", "школа 1")),
+        ("get_user_grade", lambda s: database.get_user_grade(s, tg_id)),
+        ("get_schedule_by_date", lambda s: database.get_schedule_by_date(s, tg_id, date_str)),
+        ("get_lesson_by_date_and_number", lambda s: database.get_lesson_by_date_and_number(s, tg_id, date_str, 3)),
+        ("import_schedule_from_json", lambda s: database.import_schedule_from_json(s, tg_id, [{
+            "date": date_str,
+            "lessons": [
+                {"lesson": first_subject, "classroom": "100", "lesson_number": 1, "load_level": 9}
+            ]
+        }])),
+        ("get_all_user_subjects", lambda s: database.get_all_user_subjects(s, tg_id)),
+        ("add_homework", lambda s: database.add_homework(s, tg_id, date_str, first_subject, "упр. 6")),
+        ("get_homework_by_date", lambda s: database.get_homework_by_date(s, tg_id, date_str)),
+        ("get_schedule_by_range", lambda s: database.get_schedule_by_range(s, tg_id, date_str, week_end)),
+        ("get_homework_by_range", lambda s: database.get_homework_by_range(s, tg_id, date_str, week_end)),
+        ("get_average_load_level", lambda s: database.get_average_load_level(s, tg_id, date_str)),
+        ("get_day_view", lambda s: database.get_day_view(s, tg_id, date_str)),
+        ("get_day_loads", lambda s: database.get_day_loads(s, tg_id, date_str, week_end)),
+        ("refresh_day_loads", lambda s: database.refresh_day_loads(s, class_id, [date_obj])),
+        ("refresh_user_day_loads", lambda s: database.refresh_user_day_loads(s, [date_obj], user_id=user_id)),
+        ("get_user_ids", lambda s: database.get_user_ids(s, tg_id)),
+        ("get_class_id", lambda s: database.get_class_id(s, "1А", "школа 1")),
+        ("get_day_lessons", lambda s: database.get_day_lessons(s, tg_id, date_obj)),
+        ("get_lessons_by_dates", lambda s: database.get_lessons_by_dates(
+            s, tg_id, seed_dates(days)[day:day + 7])),
+        ("find_subject_id", lambda s: database.find_subject_id(s, user_id, class_id, first_subject)),
+        ("find_subject_ids", lambda s: database.find_subject_ids(s, user_id, class_id, SUBJECTS[:3])),
+        ("lesson_not_found", lambda s: database.lesson_not_found(s, user_id, class_id, "черчение", date_str)),
+        ("edit_schedule", lambda s: database.edit_schedule(s, tg_id, [
+            {"date": date_str, "subject_from": first_subject, "subject_to": free_subject},
+            {"date": date_str, "subject_from": second_subject, "subject_to": "---"}
+        ])),
+        ("add_reminder", lambda s: database.add_reminder(s, tg_id, now + timedelta(hours=1), "проверка")),
+        ("get_pending_reminders", lambda s: database.get_pending_reminders(s, now + timedelta(hours=1))),
+        ("claim_reminders", lambda s: database.claim_reminders(s, [1, 2, 3], timedelta(minutes=15))),
+        ("release_reminder", lambda s: database.release_reminder(s, 1)),
+        ("mark_reminder_sent", lambda s: database.mark_reminder_sent(s, 1)),
+        ("add_outbox_message", lambda s: database.add_outbox_message(s, "notifications", {"tg_id": tg_id})),
+        ("get_unpublished_outbox", lambda s: database.get_unpublished_outbox(s, 100)),
+        ("mark_outbox_published", lambda s: database.mark_outbox_published(s, [1, 2, 3])),
+    ]
+
+
+def sqlite_seq_scans(plan: list) -> list[str]:
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if detail.startswith("SCAN ") and " USING " not in detail and "CONSTANT ROW" not in detail:
+            table = detail.split()[1]
+            if table in SEEDED_TABLES:
+                scans.append(detail)
+    return scans
+
+
+def postgres_seq_scans(node: dict) -> list[str]:
+    scans = []
+    if node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in SEEDED_TABLES:
+        scans.append(f"Seq Scan on {node['Relation Name']}")
+    for child in node.get("Plans", []):
+        scans.extend(postgres_seq_scans(child))
+    return scans
+
+
+async def explain(engine, statement: str, parameters) -> tuple[list[str], list[str]]:
+    async with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+            plan = result.scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            return [json.dumps(plan[0]["Plan"], ensure_ascii=False)], postgres_seq_scans(plan[0]["Plan"])
+
+        result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        plan = result.all()
+        return [row[-1] for row in plan], sqlite_seq_scans(plan)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=170)
+    parser.add_argument("--lessons", type=int, default=7)
+    parser.add_argument("--reminders", type=int, default=100_000)
+    parser.add_argument("-v", "--verbose", action="store_true", help="печатать планы всех запросов")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = await init_db(os.getenv("BENCH_DB_URL", f"sqlite+aiosqlite:///{tmp}/plans.db"))
+        session_maker = get_session_maker(engine)
+        print(f"seeding users={args.users} days={args.days} lessons={args.lessons} db={engine.url.get_backend_name()}")
+        await seed(session_maker, args.users, args.days, args.lessons, args.reminders)
+
+        captured = []
+        event.listen(
+            engine.sync_engine, "before_cursor_execute",
+            lambda conn, cursor, statement, parameters, context, executemany: captured.append(
+                (statement, parameters[0] if executemany else parameters)
+            )
+        )
+
+        checked = set()
+        failures = 0
+        for name, call in calls(args.users, args.days):
+            # кэши пропустили бы запросы, которые мы хотим проверить
+            database.subjects_cache.clear()
+            database.user_ids_cache.clear()
+            captured.clear()
+            async with session_maker() as session:
+                await call(session)
+            statements = list(captured)
+            checked.add(name)
+
+            for statement, parameters in statements:
+                if not statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+                    continue
+                plan, scans = await explain(engine, statement, parameters)
+                status = "SEQ SCAN" if scans else "ok"
+                failures += bool(scans)
+                print(f"{status:8} {name}: {' '.join(statement.split())[:100]}")
+                for line in (plan if args.verbose or scans else []):
+                    print(f"         {line}")
+
+        public = {
+            name for name, func in inspect.getmembers(database, inspect.iscoroutinefunction)
+            if func.__module__ == database.__name__ and not name.startswith("_")
+        }
+        for name in sorted(public - checked):
+            print(f"{'skipped':8} {name}: нет вызова в check_query_plans")
+
+        await engine.dispose()
+
+    print(f"{failures} queries with sequential scans")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
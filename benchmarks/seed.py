@@ -0,0 +1,147 @@
+"""Заполнение базы данными в объёме учебного года для бенчмарков.
+
+Пользователи получают tg_id начиная с FIRST_TG_ID и делятся на классы по CLASS_SIZE человек.
+У каждого класса SUBJECTS в качестве предметов и общее расписание на days дней по lessons уроков,
+в день day урок number - SUBJECTS[(day + number) % len(SUBJECTS)]. Раз в неделю у каждого
+пользователя последний урок заменён на SUBJECTS[day % len(SUBJECTS)], домашнее задание
+есть на каждый HOMEWORK_EVERY-й урок пользователя.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from db.database import refresh_day_loads, reminder_dedup_key
+from db.models import Homework, OutboxMessage, Reminder, Schedule, SchoolClass, Subject, User
+
+SUBJECTS = ["алгебра", "геомет", "рус.яз", "литер", "физика", "химия", "биолог", "англ.яз", "история", "физ-ра"]
+FIRST_TG_ID = 1_000_000
+START_DATE = date(2025, 9, 1)
+CLASS_SIZE = 30
+HOMEWORK_EVERY = 5
+CHUNK_SIZE = 5000
+
+
+def seed_dates(days: int) -> list[date]:
+    return [START_DATE + timedelta(days=day) for day in range(days)]
+
+
+def class_of(user_id: int) -> int:
+    return (user_id - 1) // CLASS_SIZE + 1
+
+
+def subject_id(class_id: int, index: int) -> int:
+    return (class_id - 1) * len(SUBJECTS) + index % len(SUBJECTS) + 1
+
+
+async def insert_chunked(session, model, rows: list):
+    for i in range(0, len(rows), CHUNK_SIZE):
+        await session.execute(insert(model), rows[i:i + CHUNK_SIZE])
+
+
+async def seed(session_maker, users: int, days: int, lessons: int, reminders: int = 0):
+    dates = seed_dates(days)
+    classes = class_of(users) if users else 0
+
+    async with session_maker() as session:
+        await insert_chunked(session, SchoolClass, [
+            {"id": class_id, "school": "школа 1", "grade": f"{class_id}А"}
+            for class_id in range(1, classes + 1)
+        ])
+        await insert_chunked(session, User, [
+            {"id": user_id, "tg_id": FIRST_TG_ID + user_id, "school": "школа 1", "grade": f"{class_of(user_id)}А",
+             "class_id": class_of(user_id)}
+            for user_id in range(1, users + 1)
+        ])
+        await insert_chunked(session, Subject, [
+            {
+                "id": subject_id(class_id, number),
+                "class_id": class_id,
+                "name": name,
+                "classroom": str(100 + number),
+                "load_level": 5 + number % 4
+            }
+            for class_id in range(1, classes + 1)
+            for number, name in enumerate(SUBJECTS)
+        ])
+
+        schedule_id = 0
+        class_lessons = {}
+        for class_id in range(1, classes + 1):
+            rows = []
+            for day, date_obj in enumerate(dates):
+                for number in range(1, lessons + 1):
+                    schedule_id += 1
+                    class_lessons[(class_id, day, number)] = schedule_id
+                    rows.append({
+                        "id": schedule_id,
+                        "class_id": class_id,
+                        "date": date_obj,
+                        "lesson_number": number,
+                        "subject_id": subject_id(class_id, day + number)
+                    })
+            await insert_chunked(session, Schedule, rows)
+
+        # изменения и домашние задания пишем по пользователю, чтобы не держать весь год в памяти
+        homework_counter = 0
+        for user_id in range(1, users + 1):
+            class_id = class_of(user_id)
+            override_rows = []
+            homework_rows = []
+            for day, date_obj in enumerate(dates):
+                lesson_ids = {number: class_lessons[(class_id, day, number)] for number in range(1, lessons + 1)}
+                if day % 7 == user_id % 7:
+                    schedule_id += 1
+                    lesson_ids[lessons] = schedule_id
+                    override_rows.append({
+                        "id": schedule_id,
+                        "user_id": user_id,
+                        "date": date_obj,
+                        "lesson_number": lessons,
+                        "subject_id": subject_id(class_id, day)
+                    })
+                for number in range(1, lessons + 1):
+                    homework_counter += 1
+                    if homework_counter % HOMEWORK_EVERY == 0:
+                        homework_rows.append({"schedule_id": lesson_ids[number], "user_id": user_id, "text": "упр. 1-5"})
+            await insert_chunked(session, Schedule, override_rows)
+            await insert_chunked(session, Homework, homework_rows)
+
+        # почти все напоминания уже отправлены, как в рабочей базе
+        now = datetime.now()
+        reminder_rows = []
+        outbox_rows = []
+        for i in range(reminders):
+            remind_at = now + timedelta(minutes=i - reminders + 100)
+            sent = remind_at < now
+            reminder_rows.append({
+                "dedup_key": reminder_dedup_key(FIRST_TG_ID + i % max(users, 1), remind_at, "текст"),
+                "tg_id": FIRST_TG_ID + i % max(users, 1),
+                "remind_at": remind_at,
+                "text": "текст",
+                "sent_at": remind_at if sent else None
+            })
+            outbox_rows.append({
+                "routing_key": "notifications",
+                "payload": "{}",
+                "created_at": remind_at,
+                "published_at": remind_at if sent else None
+            })
+        await insert_chunked(session, Reminder, reminder_rows)
+        await insert_chunked(session, OutboxMessage, outbox_rows)
+
+        if session.bind.dialect.name == "postgresql":
+            # id вставлены явно, сдвигаем последовательности за них
+            for table in ("classes", "users", "subjects", "schedule"):
+                await session.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+                ))
+
+        for class_id in range(1, classes + 1):
+            await refresh_day_loads(session, class_id)
+
+        await session.commit()
+
+    # статистика для планировщика, иначе на свежих таблицах он выбирает перебор
+    async with session_maker() as session:
+        await session.execute(text("ANALYZE"))
+        await session.commit()
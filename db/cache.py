@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        # номер последнего сброса: по нему set отбрасывает значения, прочитанные до сброса
+        self.generation = 0
+        self._invalidated = OrderedDict()
+        self._invalidated_floor = 0
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def expires_at(self) -> float:
+        return self.now() + self.ttl
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if self.now() >= expires_at:
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, generation: int | None = None):
+        """generation - значение self.generation до чтения value из базы; если ключ с тех пор
+        сбросили, value уже устарело и не кэшируется"""
+        if generation is not None and self._invalidated.get(key, self._invalidated_floor) > generation:
+            return
+        self._data[key] = (self.expires_at(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+        self.generation += 1
+        self._invalidated[key] = self.generation
+        self._invalidated.move_to_end(key)
+        # про вытесненные ключи помним только самый поздний сброс, это лишь реже кэширует
+        while len(self._invalidated) > self.max_size:
+            _, generation = self._invalidated.popitem(last=False)
+            self._invalidated_floor = generation
+
+    def clear(self):
+        self._data.clear()
+        self.generation += 1
+        self._invalidated.clear()
+        self._invalidated_floor = self.generation
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
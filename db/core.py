@@ -1,18 +1,144 @@
+import os
+import time
+
+from sqlalchemy import Column, Integer, Table, inspect, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+# create - создать недостающие таблицы, verify - только проверить версию схемы
+DB_INIT_MODE = os.getenv("DB_INIT_MODE", "create")
+
+# увеличивать при каждом изменении моделей
+SCHEMA_VERSION = 4
+# create_all только добавляет таблицы и индексы, базу старше этой версии переносит db/migrate.py
+MIN_UPGRADABLE_VERSION = 4
 
 
 class Base(DeclarativeBase):
     pass
 
 
-async def init_db(url: str):
-    engine = create_async_engine(url, echo=False)
+schema_version = Table(
+    "schema_version",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+)
+
+pool_stats = {
+    "checkouts": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Очередь соединений, которая считает, сколько запросы ждали свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            pool_stats["checkouts"] += 1
+            pool_stats["wait_total"] += waited
+            pool_stats["wait_max"] = max(pool_stats["wait_max"], waited)
+
+
+def get_pool_stats(engine) -> dict:
+    pool = engine.pool
+    stats = dict(pool_stats)
+    stats["avg_wait"] = stats["wait_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+
+    if isinstance(pool, TimedQueuePool):
+        capacity = pool.size() + DB_MAX_OVERFLOW
+        stats["size"] = pool.size()
+        stats["checked_out"] = pool.checkedout()
+        stats["overflow"] = max(pool.overflow(), 0)
+        stats["utilisation"] = pool.checkedout() / capacity if capacity else 0.0
+    return stats
+
+
+def engine_options(url: str) -> dict:
+    url = make_url(url)
+    # у sqlite своя схема пула, настройки очереди к нему не применяются
+    if url.get_backend_name() == "sqlite":
+        return {}
+
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+async def verify_schema(conn):
+    try:
+        result = await conn.execute(select(schema_version.c.version))
+    except DBAPIError:
+        raise RuntimeError("В базе нет таблицы schema_version, запустите с DB_INIT_MODE=create")
+
+    version = result.scalar()
+    if version != SCHEMA_VERSION:
+        raise RuntimeError(f"Версия схемы базы {version}, ожидается {SCHEMA_VERSION}")
+
+
+def create_indexes(conn):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def stored_version(conn) -> int | None:
+    """Версия схемы в базе: None для пустой базы, 0 для базы, созданной до schema_version"""
+    inspector = inspect(conn)
+    if not inspector.has_table("schema_version"):
+        return 0 if inspector.has_table("users") else None
+    return conn.execute(select(schema_version.c.version)).scalar()
+
+
+async def init_db(url: str, mode: str = DB_INIT_MODE):
+    engine = create_async_engine(url, echo=False, **engine_options(url))
+
+    try:
+        if mode == "verify":
+            async with engine.connect() as conn:
+                await verify_schema(conn)
+            return engine
+
+        async with engine.begin() as conn:
+            version = await conn.run_sync(stored_version)
+            if version is not None and version < MIN_UPGRADABLE_VERSION:
+                raise RuntimeError(
+                    f"Схема базы версии {version} несовместима с версией {SCHEMA_VERSION}, "
+                    f"перенесите данные в новую базу: python -m db.migrate --source <старая> --target <новая>"
+                )
 
-    async with engine.begin() as conn:
-#        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+#            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+            # create_all не добавляет новые индексы в уже существующие таблицы
+            await conn.run_sync(create_indexes)
+            await conn.execute(schema_version.delete())
+            await conn.execute(schema_version.insert().values(version=SCHEMA_VERSION))
+    except Exception:
+        await engine.dispose()
+        raise
 
     return engine
 
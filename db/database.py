@@ -1,36 +1,154 @@
-from datetime import datetime
-from sqlalchemy import func, select
+import hashlib
+import os
+from json import dumps
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, insert, select, union_all, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased
 
-from db.models import Schedule, User, Subject, Homework
+from db.cache import TTLCache
+from db.models import SchoolClass, Schedule, User, Subject, Homework, DayLoad, Reminder, OutboxMessage
 
+# ключи: ("class", class_id) - предметы класса, ("user", user_id) - собственные предметы пользователя
+subjects_cache = TTLCache(
+    max_size=int(os.getenv("SUBJECTS_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SUBJECTS_CACHE_TTL", "3600")),
+)
+BULK_CHUNK_SIZE = 1000
+# длинные периоды (четверть, полугодие) читаются страницами по столько дней
+RANGE_PAGE_DAYS = int(os.getenv("RANGE_PAGE_DAYS", "31"))
+# самый длинный период, который можно запросить разом, - примерно одна четверть
+MAX_RANGE_DAYS = int(os.getenv("MAX_RANGE_DAYS", "93"))
+
+# tg_id пользователя не меняется, поэтому (id, class_id) можно держать долго
+user_ids_cache = TTLCache(
+    max_size=int(os.getenv("USER_IDS_CACHE_SIZE", "50000")),
+    ttl=float(os.getenv("USER_IDS_CACHE_TTL", "86400")),
+)
+
+# уроки и сводки нагрузки пользователя по отдельности для класса и для самого пользователя
+ClassLoad = aliased(DayLoad)
+UserLoad = aliased(DayLoad)
+Override = aliased(Schedule)
+
+
+def parse_date(date_str: str | date):
+    if isinstance(date_str, date):
+        return date_str
 
-def parse_date(date_str: str):
     formats = ['%d.%m.%Y', '%d/%m/%Y', '%Y-%m-%d']
-    
+
     for fmt in formats:
         try:
             return datetime.strptime(date_str, fmt).date()
         except ValueError:
             continue
-    
+
     raise ValueError(f"Неподдерживаемый формат даты: {date_str}")
 
 
-async def create_user(session: AsyncSession, tg_id: int, grade: str):
+def normalize_grade(grade: str) -> str:
+    return grade.replace(" ", "").upper()
+
+
+def normalize_school(school: str) -> str:
+    # "Школа №5" и "школа 5" - одна и та же школа
+    return " ".join(school.lower().replace("ё", "е").replace("№", " ").split())
+
+
+def user_not_found(tg_id: int) -> ValueError:
+    return ValueError(f"Пользователь с tg_id={tg_id} не найден")
+
+
+def remember_user(tg_id: int, user_id: int, class_id: int | None):
+    user_ids_cache.set(tg_id, (user_id, class_id))
+
+
+def user_select(tg_id: int, *columns):
+    """select от users, к которому данные пользователя присоединяются outer join: пустой результат
+    значит, что пользователя нет, строка без данных - что данных нет"""
+    return (
+        select(User.id.label("user_id"), User.class_id, *columns)
+        .select_from(User)
+        .filter(User.tg_id == tg_id)
+    )
+
+
+def user_rows(tg_id: int, rows) -> list:
+    """Проверяет результат user_select и запоминает id и класс пользователя"""
+    if not rows:
+        raise user_not_found(tg_id)
+    remember_user(tg_id, rows[0].user_id, rows[0].class_id)
+    return rows
+
+
+def owned_by_user(model):
+    """Строки класса пользователя и его собственные: предметы, уроки или сводки нагрузки"""
+    return (model.class_id == User.class_id) | (model.user_id == User.id)
+
+
+def effective_schedule_ids(rows) -> set:
+    """Изменение пользователя заменяет урок класса с тем же днём и номером"""
+    chosen = {}
+    for row in rows:
+        if row.schedule_id is None:
+            continue
+        key = (row.date, row.lesson_number)
+        if key not in chosen or row.override is not None:
+            chosen[key] = row.schedule_id
+    return set(chosen.values())
+
+
+def pick_load(row):
+    # своя сводка есть только на дни с изменениями пользователя
+    return row.user_avg_load if row.user_load_id is not None else row.class_avg_load
+
+
+async def get_user_ids(session: AsyncSession, tg_id: int) -> tuple[int, int | None]:
+    cached = user_ids_cache.get(tg_id)
+    if cached is not None:
+        return cached
+
+    result = await session.execute(user_select(tg_id))
+    row = user_rows(tg_id, result.all())[0]
+    return row.user_id, row.class_id
+
+
+async def get_user_id(session: AsyncSession, tg_id: int) -> int:
+    user_id, _ = await get_user_ids(session, tg_id)
+    return user_id
+
+
+async def get_class_id(session: AsyncSession, grade: str, school: str) -> int:
+    """Класс определяется школой и параллелью с буквой, одноклассники делят одно расписание"""
+    school, grade = normalize_school(school), normalize_grade(grade)
+    await session.execute(
+        upsert(session, SchoolClass)
+        .values(school=school, grade=grade)
+        .on_conflict_do_nothing(index_elements=[SchoolClass.school, SchoolClass.grade])
+    )
+    result = await session.execute(
+        select(SchoolClass.id).filter_by(school=school, grade=grade)
+    )
+    return result.scalar_one()
+
+
+async def create_user(session: AsyncSession, tg_id: int, grade: str, school: str):
     result = await session.execute(
         select(User).filter_by(tg_id=tg_id)
     )
     existing_user = result.scalar_one_or_none()
-    
+
     if existing_user:
         raise ValueError(f"Пользователь с tg_id={tg_id} уже существует")
-    
-    new_user = User(tg_id=tg_id, grade=grade)
+
+    class_id = await get_class_id(session, grade, school)
+    new_user = User(tg_id=tg_id, school=school, grade=grade, class_id=class_id)
     session.add(new_user)
-    
+
     try:
         await session.commit()
     except IntegrityError as e:
@@ -45,200 +163,365 @@ async def get_user_grade(session: AsyncSession, tg_id: int) -> str | None:
     return result.scalar_one_or_none()
 
 
-async def get_schedule_by_date(session: AsyncSession, tg_id: int, date_str: str) -> list[dict]:
-    result = await session.execute(
-        select(User).filter_by(tg_id=tg_id)
-    )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise ValueError(f"Пользователь с tg_id={tg_id} не найден")
-    
-    date_obj = parse_date(date_str)
-    
+def parse_range(date_from: str | date, date_to: str | date) -> tuple[date, date]:
+    date_from, date_to = parse_date(date_from), parse_date(date_to)
+    if date_from > date_to:
+        raise ValueError(f"Начало периода {date_from:%d.%m.%Y} позже его конца {date_to:%d.%m.%Y}")
+    if (date_to - date_from).days + 1 > MAX_RANGE_DAYS:
+        raise ValueError(f"Период длиннее {MAX_RANGE_DAYS} дней, запроси его по частям")
+    return date_from, date_to
+
+
+async def iter_range(fetch, session: AsyncSession, tg_id: int, date_from: str | date, date_to: str | date,
+                     page_days: int):
+    if page_days < 1:
+        raise ValueError(f"Размер страницы должен быть не меньше одного дня, получено {page_days}")
+    date_from, date_to = parse_range(date_from, date_to)
+
+    page_start = date_from
+    while page_start <= date_to:
+        page_end = min(page_start + timedelta(days=page_days - 1), date_to)
+        for day in await fetch(session, tg_id, page_start, page_end):
+            yield day
+        page_start = page_end + timedelta(days=1)
+
+
+async def get_schedule_by_range(session: AsyncSession, tg_id: int, date_from: str | date,
+                                date_to: str | date) -> list[dict]:
+    """Уроки по дням за период, включая обе границы, одним запросом; дни без уроков пропускаются"""
+    date_from, date_to = parse_range(date_from, date_to)
+
     result = await session.execute(
-        select(Schedule)
-        .options(selectinload(Schedule.subject))
-        .filter_by(user_id=user.id, date=date_obj)
-        .order_by(Schedule.lesson_number)
+        user_select(tg_id, Schedule.id.label("schedule_id"),
+                    Schedule.user_id.label("override"), Schedule.date, Schedule.lesson_number,
+                    Subject.id.label("subject_id"), Subject.name, Subject.classroom)
+        .outerjoin(Schedule, Schedule.date.between(date_from, date_to) & owned_by_user(Schedule))
+        .outerjoin(Subject, Schedule.subject_id == Subject.id)
+        .order_by(Schedule.date, Schedule.lesson_number)
     )
-    schedules = result.scalars().all()
-    
-    return [
-        {
-            "lesson_number": s.lesson_number,
-            "lesson": s.subject.name if s.subject else None,
-            "classroom": s.subject.classroom if s.subject else None,
-            "schedule_id": s.id
-        }
-        for s in schedules
-    ]
+    rows = user_rows(tg_id, result.all())
+
+    schedule_ids = effective_schedule_ids(rows)
+    days = {}
+    for row in rows:
+        if row.schedule_id not in schedule_ids:
+            continue
+        days.setdefault(row.date, []).append({
+            "lesson_number": row.lesson_number,
+            "lesson": row.name if row.subject_id else None,
+            "classroom": row.classroom if row.subject_id else None,
+            "schedule_id": row.schedule_id
+        })
+
+    return [{"date": date_obj, "lessons": lessons} for date_obj, lessons in days.items()]
+
+
+def iter_schedule_by_range(session: AsyncSession, tg_id: int, date_from: str | date, date_to: str | date,
+                           page_days: int = RANGE_PAGE_DAYS):
+    """Уроки за длинный период по дням, по запросу на каждые page_days дней"""
+    return iter_range(get_schedule_by_range, session, tg_id, date_from, date_to, page_days)
+
+
+async def get_schedule_by_date(session: AsyncSession, tg_id: int, date_str: str) -> list[dict]:
+    days = await get_schedule_by_range(session, tg_id, date_str, date_str)
+    return days[0]["lessons"] if days else []
 
 
 async def get_lesson_by_date_and_number(session: AsyncSession, tg_id: int, date_str: str, lesson_number: int) -> dict | None:
-    result = await session.execute(
-        select(User).filter_by(tg_id=tg_id)
-    )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise ValueError(f"Пользователь с tg_id={tg_id} не найден")
-    
     date_obj = parse_date(date_str)
-    
+
     result = await session.execute(
-        select(Schedule)
-        .options(selectinload(Schedule.subject))
-        .filter_by(user_id=user.id, date=date_obj, lesson_number=lesson_number)
+        user_select(tg_id, Schedule.id.label("schedule_id"),
+                    Schedule.user_id.label("override"), Schedule.date, Schedule.lesson_number,
+                    Subject.id.label("subject_id"), Subject.name, Subject.classroom)
+        .outerjoin(Schedule, (Schedule.date == date_obj) & (Schedule.lesson_number == lesson_number)
+                   & owned_by_user(Schedule))
+        .outerjoin(Subject, Schedule.subject_id == Subject.id)
     )
-    schedule = result.scalar_one_or_none()
-    
-    if not schedule:
+    rows = user_rows(tg_id, result.all())
+
+    schedule_ids = effective_schedule_ids(rows)
+    if not schedule_ids:
         return None
-    
+
+    row = next(row for row in rows if row.schedule_id in schedule_ids)
     return {
-        "lesson_number": schedule.lesson_number,
-        "lesson": schedule.subject.name if schedule.subject else None,
-        "classroom": schedule.subject.classroom or "" + " кабинет!" if schedule.subject else None,
-        "schedule_id": schedule.id
+        "lesson_number": row.lesson_number,
+        "lesson": row.name if row.subject_id else None,
+        "classroom": row.classroom or "" + " кабинет!" if row.subject_id else None,
+        "schedule_id": row.schedule_id
     }
 
 
-async def import_schedule_from_json(session: AsyncSession, tg_id: int, schedule_data: list):
-    result = await session.execute(
-        select(User).filter_by(tg_id=tg_id)
+def upsert(session: AsyncSession, model):
+    if session.bind.dialect.name == "sqlite":
+        return sqlite_insert(model)
+    return pg_insert(model)
+
+
+def chunked(rows: list, size: int = BULK_CHUNK_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+async def upsert_day_loads(session: AsyncSession, summary, owner):
+    stmt = upsert(session, DayLoad).from_select(
+        [owner.key, "date", "avg_load", "max_load", "lesson_count"], summary
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[owner, DayLoad.date],
+        set_={
+            "avg_load": stmt.excluded.avg_load,
+            "max_load": stmt.excluded.max_load,
+            "lesson_count": stmt.excluded.lesson_count,
+        }
+    )
+    await session.execute(stmt)
+
+
+async def refresh_user_day_loads(session: AsyncSession, dates: list | None = None, *,
+                                 user_id: int | None = None, class_id: int | None = None):
+    """Пересчитывает сводку пользователя (или всех пользователей класса) на дни с его изменениями"""
+    # сначала пользователи и дни, где есть изменения, чтобы дальше искать уроки только по индексам
+    touched = (
+        select(User.id.label("user_id"), User.class_id, Override.date)
+        .join(Override, Override.user_id == User.id)
+        .where(User.id == user_id if user_id is not None else User.class_id == class_id)
+        .distinct()
+    )
+    if dates is not None:
+        touched = touched.where(Override.date.in_(dates))
+    touched = touched.cte("touched")
+
+    lessons = union_all(
+        # уроки класса, кроме заменённых изменением пользователя
+        select(touched.c.user_id, Schedule.date, Schedule.subject_id)
+        .join(Schedule, (Schedule.class_id == touched.c.class_id) & (Schedule.date == touched.c.date))
+        .where(~select(Override.id).where(
+            Override.user_id == touched.c.user_id,
+            Override.date == Schedule.date,
+            Override.lesson_number == Schedule.lesson_number
+        ).exists()),
+        # изменения пользователя
+        select(touched.c.user_id, Schedule.date, Schedule.subject_id)
+        .join(Schedule, (Schedule.user_id == touched.c.user_id) & (Schedule.date == touched.c.date))
+    ).subquery("lessons")
+
+    summary = (
+        select(lessons.c.user_id, lessons.c.date, func.avg(Subject.load_level),
+               func.max(Subject.load_level), func.count(Subject.id))
+        .select_from(lessons)
+        .outerjoin(Subject, lessons.c.subject_id == Subject.id)
+        .group_by(lessons.c.user_id, lessons.c.date)
     )
-    user = result.scalar_one_or_none()
 
-    if not user:
-        raise ValueError(f"Пользователь с tg_id={tg_id} не найден")
+    await upsert_day_loads(session, summary, DayLoad.user_id)
 
+
+async def refresh_day_loads(session: AsyncSession, class_id: int, dates: list | None = None):
+    """Пересчитывает сводку нагрузки класса по дням, без dates - по всем дням"""
+    summary = (
+        select(Schedule.class_id, Schedule.date, func.avg(Subject.load_level),
+               func.max(Subject.load_level), func.count(Subject.id))
+        .select_from(Schedule)
+        .outerjoin(Subject, Schedule.subject_id == Subject.id)
+        .where(Schedule.class_id == class_id)
+        .group_by(Schedule.class_id, Schedule.date)
+    )
+    if dates is not None:
+        summary = summary.where(Schedule.date.in_(dates))
+
+    await upsert_day_loads(session, summary, DayLoad.class_id)
+    # у одноклассников со своими изменениями сводка зависит и от уроков класса
+    await refresh_user_day_loads(session, dates, class_id=class_id)
+
+
+async def import_schedule_from_json(session: AsyncSession, tg_id: int, schedule_data: list):
+    _, class_id = await get_user_ids(session, tg_id)
+
+    subjects = {}
+    lessons = {}
     for day_data in schedule_data:
         date_obj = parse_date(day_data['date'])
 
         for lesson_data in day_data['lessons']:
             subject_name = lesson_data['lesson']
             classroom = lesson_data['classroom'] or None
-            lesson_number = lesson_data['lesson_number']
             load_level = lesson_data.get('load_level', 5)
 
-            result = await session.execute(
-                select(Subject).filter_by(
-                    user_id=user.id,
-                    name=subject_name
-                )
-            )
-            subject = result.scalar_one_or_none()
-            
-            if not subject:
-                subject = Subject(
-                    user_id=user.id,
-                    name=subject_name,
-                    classroom=classroom,
-                    load_level=load_level
-                )
-                session.add(subject)
-                await session.flush()
-            else:
-                if classroom and not subject.classroom:
-                    subject.classroom = classroom
-                if load_level and not subject.load_level:
-                    subject.load_level = load_level
+            subject = subjects.setdefault(subject_name, {
+                "class_id": class_id,
+                "name": subject_name,
+                "classroom": classroom,
+                "load_level": load_level
+            })
+            if classroom and not subject["classroom"]:
+                subject["classroom"] = classroom
+            if load_level and not subject["load_level"]:
+                subject["load_level"] = load_level
+
+            lessons[(date_obj, lesson_data['lesson_number'])] = subject_name
 
-            result = await session.execute(
-                select(Schedule).filter_by(
-                    user_id=user.id,
-                    date=date_obj,
-                    lesson_number=lesson_number
-                )
-            )
-            schedule_entry = result.scalar_one_or_none()
-            
-            if not schedule_entry:
-                schedule_entry = Schedule(
-                    user_id=user.id,
-                    date=date_obj,
-                    lesson_number=lesson_number,
-                    subject_id=subject.id
-                )
-                session.add(schedule_entry)
-            else:
-                schedule_entry.subject_id = subject.id
-    
     try:
+        subject_ids = {}
+        for rows in chunked(list(subjects.values())):
+            stmt = upsert(session, Subject).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Subject.class_id, Subject.name],
+                set_={
+                    "classroom": func.coalesce(Subject.classroom, stmt.excluded.classroom),
+                    "load_level": func.coalesce(
+                        func.nullif(Subject.load_level, 0),
+                        func.nullif(stmt.excluded.load_level, 0),
+                        Subject.load_level
+                    ),
+                }
+            ).returning(Subject.id, Subject.name)
+            result = await session.execute(stmt)
+            subject_ids.update({name: subject_id for subject_id, name in result.all()})
+
+        schedule_rows = [
+            {
+                "class_id": class_id,
+                "date": date_obj,
+                "lesson_number": lesson_number,
+                "subject_id": subject_ids[subject_name]
+            }
+            for (date_obj, lesson_number), subject_name in lessons.items()
+        ]
+        for rows in chunked(schedule_rows):
+            stmt = upsert(session, Schedule).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Schedule.class_id, Schedule.date, Schedule.lesson_number],
+                set_={"subject_id": stmt.excluded.subject_id}
+            )
+            await session.execute(stmt)
+
+        # нагрузка предмета могла измениться, поэтому пересчитываем все дни, а не только загруженные
+        await refresh_day_loads(session, class_id)
+
         await session.commit()
     except IntegrityError as e:
         await session.rollback()
         raise Exception(f"Ошибка при сохранении данных: {str(e)}")
-
+    finally:
+        subjects_cache.invalidate(("class", class_id))
 
 
 async def get_all_user_subjects(session: AsyncSession, tg_id: int) -> list[dict]:
+    ids = user_ids_cache.get(tg_id)
+    if ids is not None:
+        user_id, class_id = ids
+        class_subjects = subjects_cache.get(("class", class_id))
+        user_subjects = subjects_cache.get(("user", user_id))
+        if class_subjects is not None and user_subjects is not None:
+            return [dict(s) for s in sorted(class_subjects + user_subjects, key=lambda s: s["name"])]
+
+    # импорт, завершившийся во время запроса, сбросит кэш, и прочитанный до него список не запишется
+    generation = subjects_cache.generation
     result = await session.execute(
-        select(User).filter_by(tg_id=tg_id)
-    )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise ValueError(f"Пользователь с tg_id={tg_id} не найден")
-    
-    result = await session.execute(
-        select(Subject).filter_by(user_id=user.id).order_by(Subject.name)
+        user_select(tg_id, Subject.id.label("subject_id"), Subject.user_id.label("owner"), Subject.name,
+                    Subject.classroom)
+        .outerjoin(Subject, owned_by_user(Subject))
+        .order_by(Subject.name)
     )
-    subjects = result.scalars().all()
-    
-    return [
+    rows = user_rows(tg_id, result.all())
+    user_id, class_id = rows[0].user_id, rows[0].class_id
+
+    subjects = [
         {
-            "id": s.id,
-            "name": s.name,
-            "classroom": s.classroom
+            "id": row.subject_id,
+            "name": row.name,
+            "classroom": row.classroom
         }
-        for s in subjects
+        for row in rows
+        if row.subject_id is not None
     ]
+    subjects_cache.set(("class", class_id), [s for s, row in zip(subjects, rows) if row.owner is None], generation)
+    subjects_cache.set(("user", user_id), [s for s, row in zip(subjects, rows) if row.owner is not None], generation)
 
+    return [dict(s) for s in subjects]
 
-async def add_homework(session: AsyncSession, tg_id: int, date_str: str, subject_name: str, homework_text: str):
+
+async def get_lessons_by_dates(session: AsyncSession, tg_id: int, dates: list) -> tuple[int, int | None, dict]:
+    """Действующие уроки пользователя на несколько дней одним запросом: {дата: [уроки по номеру]}"""
     result = await session.execute(
-        select(User).filter_by(tg_id=tg_id)
+        user_select(tg_id, Schedule.id.label("schedule_id"),
+                    Schedule.user_id.label("override"), Schedule.date, Schedule.lesson_number, Subject.name)
+        .outerjoin(Schedule, Schedule.date.in_(dates) & owned_by_user(Schedule))
+        .outerjoin(Subject, Schedule.subject_id == Subject.id)
+        .order_by(Schedule.date, Schedule.lesson_number)
     )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise ValueError(f"Пользователь с tg_id={tg_id} не найден")
-    
-    date_obj = parse_date(date_str)
-    
+    rows = user_rows(tg_id, result.all())
+
+    schedule_ids = effective_schedule_ids(rows)
+    days = {date_obj: [] for date_obj in dates}
+    for row in rows:
+        if row.schedule_id in schedule_ids:
+            days[row.date].append(row)
+    return rows[0].user_id, rows[0].class_id, days
+
+
+async def get_day_lessons(session: AsyncSession, tg_id: int, date_obj) -> tuple[int, int | None, list]:
+    """Действующие уроки пользователя на день с названиями предметов"""
+    user_id, class_id, days = await get_lessons_by_dates(session, tg_id, [date_obj])
+    return user_id, class_id, days[date_obj]
+
+
+async def find_subject_id(session: AsyncSession, user_id: int, class_id: int | None, name: str) -> int | None:
     result = await session.execute(
-        select(Subject).filter_by(user_id=user.id, name=subject_name)
+        select(Subject.id)
+        .where((Subject.class_id == class_id) | (Subject.user_id == user_id), Subject.name == name)
+        .limit(1)
     )
-    subject = result.scalar_one_or_none()
-    
-    if not subject:
-        raise ValueError(f"Предмет '{subject_name}' не найден у пользователя")
-    
+    return result.scalar_one_or_none()
+
+
+async def find_subject_ids(session: AsyncSession, user_id: int, class_id: int | None, names) -> dict:
+    """id предметов класса и пользователя по названиям, собственный предмет пользователя важнее"""
     result = await session.execute(
-        select(Schedule).filter_by(
-            user_id=user.id,
-            date=date_obj,
-            subject_id=subject.id
-        )
+        select(Subject.id, Subject.user_id, Subject.name)
+        .where((Subject.class_id == class_id) | (Subject.user_id == user_id), Subject.name.in_(names))
     )
-    schedule = result.scalar_one_or_none()
-    
-    if not schedule:
-        raise ValueError(f"Урок '{subject_name}' на дату {date_str} не найден в расписании")
-    
+    subject_ids = {}
+    for subject_id, owner, name in result.all():
+        if name not in subject_ids or owner is not None:
+            subject_ids[name] = subject_id
+    return subject_ids
+
+
+def lesson_error(subject_name: str, date_str: str, subject_exists: bool) -> ValueError:
+    if not subject_exists:
+        return ValueError(f"Предмет '{subject_name}' не найден у пользователя")
+    return ValueError(f"Урок '{subject_name}' на дату {date_str} не найден в расписании")
+
+
+async def lesson_not_found(session: AsyncSession, user_id: int, class_id: int | None,
+                           subject_name: str, date_str: str) -> ValueError:
+    subject_id = await find_subject_id(session, user_id, class_id, subject_name)
+    return lesson_error(subject_name, date_str, subject_id is not None)
+
+
+async def add_homework(session: AsyncSession, tg_id: int, date_str: str, subject_name: str, homework_text: str):
+    date_obj = parse_date(date_str)
+
+    user_id, class_id, lessons = await get_day_lessons(session, tg_id, date_obj)
+    lesson = next((row for row in lessons if row.name == subject_name), None)
+
+    if lesson is None:
+        raise await lesson_not_found(session, user_id, class_id, subject_name, date_str)
+
     result = await session.execute(
-        select(Homework).filter_by(schedule_id=schedule.id)
+        select(Homework).filter_by(user_id=user_id, schedule_id=lesson.schedule_id)
     )
-    existing_homework = result.scalar_one_or_none()
-    
+    existing_homework = result.scalars().first()
+
     if existing_homework:
         existing_homework.text = existing_homework.text + "\n" + homework_text
     else:
-        homework = Homework(schedule_id=schedule.id, text=homework_text)
+        homework = Homework(schedule_id=lesson.schedule_id, user_id=user_id, text=homework_text)
         session.add(homework)
-    
+
     try:
         await session.commit()
     except IntegrityError as e:
@@ -246,116 +529,327 @@ async def add_homework(session: AsyncSession, tg_id: int, date_str: str, subject
         raise Exception(f"Ошибка при сохранении домашнего задания: {str(e)}")
 
 
-async def get_homework_by_date(session: AsyncSession, tg_id: int, date_str: str) -> list[dict]:
+
+async def get_homework_by_range(session: AsyncSession, tg_id: int, date_from: str | date,
+                                date_to: str | date) -> list[dict]:
+    """Домашние задания по дням за период, включая обе границы, одним запросом; дни без заданий пропускаются"""
+    date_from, date_to = parse_range(date_from, date_to)
+
     result = await session.execute(
-        select(User).filter_by(tg_id=tg_id)
+        user_select(tg_id, Schedule.id.label("schedule_id"),
+                    Schedule.user_id.label("override"), Schedule.date, Schedule.lesson_number, Subject.name,
+                    Homework.id.label("homework_id"), Homework.text)
+        .outerjoin(Schedule, Schedule.date.between(date_from, date_to) & owned_by_user(Schedule))
+        .outerjoin(Subject, Schedule.subject_id == Subject.id)
+        .outerjoin(Homework, (Homework.schedule_id == Schedule.id) & (Homework.user_id == User.id))
+        .order_by(Schedule.date, Schedule.lesson_number, Homework.id)
     )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise ValueError(f"Пользователь с tg_id={tg_id} не найден")
-    
+    rows = user_rows(tg_id, result.all())
+
+    schedule_ids = effective_schedule_ids(rows)
+    days = {}
+    for row in rows:
+        if row.homework_id is None or row.schedule_id not in schedule_ids:
+            continue
+        days.setdefault(row.date, []).append({
+            "lesson_number": row.lesson_number,
+            "subject": row.name,
+            "text": row.text,
+            "homework_id": row.homework_id
+        })
+
+    return [{"date": date_obj, "homework": homework} for date_obj, homework in days.items()]
+
+
+def iter_homework_by_range(session: AsyncSession, tg_id: int, date_from: str | date, date_to: str | date,
+                           page_days: int = RANGE_PAGE_DAYS):
+    """Домашние задания за длинный период по дням, по запросу на каждые page_days дней"""
+    return iter_range(get_homework_by_range, session, tg_id, date_from, date_to, page_days)
+
+
+async def get_homework_by_date(session: AsyncSession, tg_id: int, date_str: str) -> list[dict]:
+    days = await get_homework_by_range(session, tg_id, date_str, date_str)
+    return days[0]["homework"] if days else []
+
+
+async def get_average_load_level(session: AsyncSession, tg_id: int, date_str: str) -> float | None:
     date_obj = parse_date(date_str)
-    
+
     result = await session.execute(
-        select(Schedule)
-        .options(selectinload(Schedule.subject), selectinload(Schedule.homework))
-        .filter_by(user_id=user.id, date=date_obj)
-        .order_by(Schedule.lesson_number)
+        user_select(tg_id, UserLoad.id.label("user_load_id"),
+                    UserLoad.avg_load.label("user_avg_load"), ClassLoad.avg_load.label("class_avg_load"))
+        .outerjoin(ClassLoad, (ClassLoad.class_id == User.class_id) & (ClassLoad.date == date_obj))
+        .outerjoin(UserLoad, (UserLoad.user_id == User.id) & (UserLoad.date == date_obj))
     )
-    schedules = result.scalars().all()
-    
-    homework_list = []
-    for schedule in schedules:
-        if schedule.homework:
-            for hw in schedule.homework:
-                homework_list.append({
-                    "lesson_number": schedule.lesson_number,
-                    "subject": schedule.subject.name if schedule.subject else None,
-                    "text": hw.text,
-                    "homework_id": hw.id
-                })
-    
-    return homework_list
+    row = user_rows(tg_id, result.all())[0]
+
+    avg_load = pick_load(row)
+    return float(avg_load) if avg_load is not None else None
 
 
-async def get_average_load_level(session: AsyncSession, tg_id: int, date_str: str) -> float | None:
+async def get_day_loads(session: AsyncSession, tg_id: int, date_from: str, date_to: str) -> list[dict]:
+    """Сводка нагрузки по дням за период, включая обе границы"""
     result = await session.execute(
-        select(User).filter_by(tg_id=tg_id)
+        user_select(tg_id, DayLoad.user_id.label("override"), DayLoad.date,
+                    DayLoad.avg_load, DayLoad.max_load, DayLoad.lesson_count)
+        .outerjoin(DayLoad, owned_by_user(DayLoad)
+                   & DayLoad.date.between(parse_date(date_from), parse_date(date_to)))
+        .order_by(DayLoad.date)
     )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise ValueError(f"Пользователь с tg_id={tg_id} не найден")
-    
+    rows = user_rows(tg_id, result.all())
+
+    # на дни с изменениями пользователя есть и сводка класса, и его собственная
+    days = {}
+    for row in rows:
+        if row.date is not None and (row.date not in days or row.override is not None):
+            days[row.date] = row
+
+    return [
+        {
+            "date": row.date,
+            "avg_load": float(row.avg_load) if row.avg_load is not None else None,
+            "max_load": row.max_load,
+            "lesson_count": row.lesson_count
+        }
+        for row in days.values()
+    ]
+
+
+async def get_day_view(session: AsyncSession, tg_id: int, date_str: str) -> dict:
+    """Уроки, средняя нагрузка и домашнее задание на день одним запросом"""
     date_obj = parse_date(date_str)
-    
+
     result = await session.execute(
-        select(func.avg(Subject.load_level))
-        .select_from(Schedule)
-        .join(Subject, Schedule.subject_id == Subject.id)
-        .filter(Schedule.user_id == user.id, Schedule.date == date_obj)
+        user_select(tg_id, UserLoad.id.label("user_load_id"),
+                    UserLoad.avg_load.label("user_avg_load"), ClassLoad.avg_load.label("class_avg_load"),
+                    Schedule.id.label("schedule_id"), Schedule.user_id.label("override"), Schedule.date, Schedule.lesson_number,
+                    Subject.id.label("subject_id"), Subject.name, Subject.classroom,
+                    Homework.id.label("homework_id"), Homework.text)
+        .outerjoin(ClassLoad, (ClassLoad.class_id == User.class_id) & (ClassLoad.date == date_obj))
+        .outerjoin(UserLoad, (UserLoad.user_id == User.id) & (UserLoad.date == date_obj))
+        .outerjoin(Schedule, (Schedule.date == date_obj) & owned_by_user(Schedule))
+        .outerjoin(Subject, Schedule.subject_id == Subject.id)
+        .outerjoin(Homework, (Homework.schedule_id == Schedule.id) & (Homework.user_id == User.id))
+        .order_by(Schedule.lesson_number, Homework.id)
     )
-    avg_load = result.scalar()
-    
-    return float(avg_load) if avg_load is not None else None
+    rows = user_rows(tg_id, result.all())
+
+    schedule_ids = effective_schedule_ids(rows)
+    lessons = {}
+    homework = []
+    for row in rows:
+        if row.schedule_id not in schedule_ids:
+            continue
+
+        # у урока с несколькими заданиями несколько строк
+        if row.schedule_id not in lessons:
+            lessons[row.schedule_id] = {
+                "lesson_number": row.lesson_number,
+                "lesson": row.name if row.subject_id else None,
+                "classroom": row.classroom if row.subject_id else None,
+                "schedule_id": row.schedule_id
+            }
+        if row.homework_id is not None:
+            homework.append({
+                "lesson_number": row.lesson_number,
+                "subject": row.name,
+                "text": row.text,
+                "homework_id": row.homework_id
+            })
+
+    avg_load = pick_load(rows[0])
+
+    return {
+        "lessons": list(lessons.values()),
+        "average_load": float(avg_load) if avg_load is not None else None,
+        "homework": homework
+    }
 
 
 async def edit_schedule(session: AsyncSession, tg_id: int, changes: list[dict]):
-    result = await session.execute(
-        select(User).filter_by(tg_id=tg_id)
-    )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise ValueError(f"Пользователь с tg_id={tg_id} не найден")
-    
+    dates = list({parse_date(change["date"]) for change in changes})
+    user_id, class_id, days = await get_lessons_by_dates(session, tg_id, dates)
+
+    names = {change["subject_from"] for change in changes} | {change["subject_to"] for change in changes}
+    subject_ids = await find_subject_ids(session, user_id, class_id, names - {"---"})
+
+    # изменения применяются по порядку, следующее видит результат предыдущих,
+    # поэтому сначала разбираем их в памяти и только потом пишем всё разом
+    lessons = {
+        date_obj: [{"lesson_number": row.lesson_number, "name": row.name, "schedule_id": row.schedule_id,
+                    "override": row.override is not None} for row in rows]
+        for date_obj, rows in days.items()
+    }
+    new_subjects = {}
+    overrides = {}
+    moved_schedule_ids = set()
     for change in changes:
         date_obj = parse_date(change["date"])
         subject_from_name = change["subject_from"]
         subject_to_name = change["subject_to"]
-        
-        result = await session.execute(
-            select(Subject).filter_by(user_id=user.id, name=subject_from_name)
-        )
-        subject_from = result.scalar_one_or_none()
-        
-        if not subject_from:
-            raise ValueError(f"Предмет '{subject_from_name}' не найден у пользователя")
-        
-        result = await session.execute(
-            select(Schedule).filter_by(
-                user_id=user.id,
-                date=date_obj,
-                subject_id=subject_from.id
-            )
-        )
-        schedule_entry = result.scalar_one_or_none()
-        
-        if not schedule_entry:
-            raise ValueError(f"Урок '{subject_from_name}' на дату {change['date']} не найден в расписании")
-        
-        if subject_to_name == "---":
-            schedule_entry.subject_id = None
-        else:
+
+        lesson = next((row for row in lessons[date_obj] if row["name"] == subject_from_name), None)
+        if lesson is None:
+            subject_exists = subject_from_name in subject_ids or subject_from_name in new_subjects
+            raise lesson_error(subject_from_name, change["date"], subject_exists)
+
+        if subject_to_name != "---" and subject_to_name not in subject_ids:
+            new_subjects[subject_to_name] = {"user_id": user_id, "name": subject_to_name, "classroom": None}
+
+        if not lesson["override"]:
+            # урок класса не трогаем, а заменяем его только для этого пользователя
+            moved_schedule_ids.add(lesson["schedule_id"])
+            lesson["override"] = True
+        lesson["name"] = None if subject_to_name == "---" else subject_to_name
+        overrides[(date_obj, lesson["lesson_number"])] = lesson["name"]
+
+    try:
+        if new_subjects:
             result = await session.execute(
-                select(Subject).filter_by(user_id=user.id, name=subject_to_name)
+                insert(Subject).values(list(new_subjects.values())).returning(Subject.id, Subject.name)
             )
-            subject_to = result.scalar_one_or_none()
-            
-            if not subject_to:
-                subject_to = Subject(
-                    user_id=user.id,
-                    name=subject_to_name,
-                    classroom=None
-                )
-                session.add(subject_to)
-                await session.flush()
-            
-            schedule_entry.subject_id = subject_to.id
-    
-    try:
+            subject_ids.update({name: subject_id for subject_id, name in result.all()})
+
+        override_rows = [
+            {
+                "user_id": user_id,
+                "date": date_obj,
+                "lesson_number": lesson_number,
+                "subject_id": subject_ids[name] if name is not None else None
+            }
+            for (date_obj, lesson_number), name in overrides.items()
+        ]
+        for rows in chunked(override_rows):
+            stmt = upsert(session, Schedule).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Schedule.user_id, Schedule.date, Schedule.lesson_number],
+                set_={"subject_id": stmt.excluded.subject_id}
+            )
+            await session.execute(stmt)
+
+        if moved_schedule_ids:
+            # домашнее задание пользователя переезжает с урока класса на его замену
+            await session.execute(
+                update(Homework)
+                .where(Homework.user_id == user_id, Homework.schedule_id.in_(moved_schedule_ids))
+                .values(schedule_id=select(Override.id).where(
+                    Schedule.id == Homework.schedule_id,
+                    Override.user_id == user_id,
+                    Override.date == Schedule.date,
+                    Override.lesson_number == Schedule.lesson_number
+                ).scalar_subquery())
+                .execution_options(synchronize_session=False)
+            )
+
+        await refresh_user_day_loads(session, dates, user_id=user_id)
         await session.commit()
     except IntegrityError as e:
         await session.rollback()
         raise Exception(f"Ошибка при изменении расписания: {str(e)}")
+    finally:
+        subjects_cache.invalidate(("user", user_id))
+
+
+def reminder_dedup_key(tg_id: int, remind_at: datetime, text: str) -> str:
+    return hashlib.sha256(f"{tg_id}|{remind_at.isoformat()}|{text}".encode()).hexdigest()
+
+
+async def add_reminder(session: AsyncSession, tg_id: int, remind_at: datetime, text: str,
+                       dedup_key: str | None = None) -> int | None:
+    """Сохраняет напоминание, возвращает его id или None, если такое уже есть"""
+    stmt = upsert(session, Reminder).values(
+        dedup_key=dedup_key or reminder_dedup_key(tg_id, remind_at, text),
+        tg_id=tg_id,
+        remind_at=remind_at,
+        text=text
+    ).on_conflict_do_nothing(index_elements=[Reminder.dedup_key]).returning(Reminder.id)
+
+    result = await session.execute(stmt)
+    reminder_id = result.scalar_one_or_none()
+    await session.commit()
+    return reminder_id
+
+
+async def get_pending_reminders(session: AsyncSession, until: datetime) -> list[tuple[int, datetime]]:
+    result = await session.execute(
+        select(Reminder.id, Reminder.remind_at)
+        .filter(Reminder.sent_at.is_(None), Reminder.remind_at < until)
+    )
+    return [(reminder_id, remind_at) for reminder_id, remind_at in result.all()]
+
+
+async def claim_reminders(session: AsyncSession, reminder_ids: list[int], lease: timedelta) -> list[dict]:
+    """Забирает напоминания на отправку, пропуская уже отправленные и занятые другим процессом"""
+    now = datetime.now()
+    result = await session.execute(
+        update(Reminder)
+        .where(
+            Reminder.id.in_(reminder_ids),
+            Reminder.sent_at.is_(None),
+            (Reminder.locked_until.is_(None)) | (Reminder.locked_until < now)
+        )
+        .values(locked_until=now + lease)
+        .returning(Reminder.id, Reminder.tg_id, Reminder.text, Reminder.remind_at)
+    )
+    reminders = [
+        {"id": reminder_id, "tg_id": tg_id, "text": text, "remind_at": remind_at}
+        for reminder_id, tg_id, text, remind_at in result.all()
+    ]
+    await session.commit()
+    return reminders
+
+
+async def release_reminder(session: AsyncSession, reminder_id: int):
+    await session.execute(
+        update(Reminder)
+        .where(Reminder.id == reminder_id, Reminder.sent_at.is_(None))
+        .values(locked_until=None)
+    )
+    await session.commit()
+
+
+async def mark_reminder_sent(session: AsyncSession, reminder_id: int):
+    await session.execute(
+        update(Reminder)
+        .where(Reminder.id == reminder_id)
+        .values(sent_at=datetime.now(), locked_until=None)
+    )
+    await session.commit()
+
+
+async def add_outbox_message(session: AsyncSession, routing_key: str, payload: dict) -> int:
+    message = OutboxMessage(
+        routing_key=routing_key,
+        payload=dumps(payload, ensure_ascii=False),
+        created_at=datetime.now()
+    )
+    session.add(message)
+
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        raise Exception(f"Ошибка при сохранении сообщения: {str(e)}")
+
+    return message.id
+
+
+async def get_unpublished_outbox(session: AsyncSession, limit: int) -> list[OutboxMessage]:
+    """Выбирает неотправленные сообщения и блокирует их до конца транзакции"""
+    result = await session.execute(
+        select(OutboxMessage)
+        .filter(OutboxMessage.published_at.is_(None))
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    return list(result.scalars().all())
+
+
+async def mark_outbox_published(session: AsyncSession, message_ids: list[int]):
+    await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(message_ids))
+        .values(published_at=datetime.now())
+    )
+    await session.commit()
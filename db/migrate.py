@@ -0,0 +1,281 @@
+"""Перенос базы со схемы с личными расписаниями (версии 0-3) на расписания классов.
+
+python -m db.migrate --source OLD_URL --target NEW_URL
+
+Старая база не меняется: данные копируются в новую пустую базу, после проверки POSTGRES_URL
+переключают на неё, а старая остаётся резервной копией.
+
+Школу раньше не спрашивали, поэтому класс определяется по самим расписаниям: пользователи одной
+параллели, у которых совпадает не меньше MIGRATE_MATCH_RATIO общих уроков, попадают в один класс.
+Уроки, которые есть у всех учеников класса, становятся уроками класса (предмет - тот, что у
+большинства), а всё, чем расписание ученика от них отличается, - его изменениями. Такие классы
+получают школу "legacy-<id первого ученика>", чтобы новые пользователи к ним не присоединялись.
+"""
+import argparse
+import asyncio
+import os
+from collections import Counter, defaultdict
+
+from sqlalchemy import BigInteger, Column, Date, Integer, MetaData, String, Table, Text, inspect, insert, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from db.core import MIN_UPGRADABLE_VERSION, init_db, get_session_maker, stored_version
+from db.database import chunked, normalize_grade, refresh_day_loads
+from db.models import FSMState, Homework, OutboxMessage, Reminder, Schedule, SchoolClass, Subject, User
+
+MATCH_RATIO = float(os.getenv("MIGRATE_MATCH_RATIO", "0.8"))
+USERS_CHUNK_SIZE = 500
+
+legacy = MetaData()
+legacy_users = Table(
+    "users", legacy,
+    Column("id", Integer), Column("tg_id", BigInteger), Column("grade", String),
+)
+legacy_subjects = Table(
+    "subjects", legacy,
+    Column("id", Integer), Column("user_id", Integer), Column("name", String),
+    Column("classroom", String), Column("load_level", Integer),
+)
+legacy_schedule = Table(
+    "schedule", legacy,
+    Column("id", Integer), Column("user_id", Integer), Column("date", Date),
+    Column("lesson_number", Integer), Column("subject_id", Integer),
+)
+legacy_homework = Table(
+    "homework", legacy,
+    Column("id", Integer), Column("schedule_id", Integer), Column("text", Text),
+)
+
+# таблицы, которые не менялись и копируются как есть
+COPIED_TABLES = [Reminder.__table__, OutboxMessage.__table__, FSMState.__table__]
+
+
+def agreement(a: dict, b: dict) -> float | None:
+    """Доля общих уроков с одинаковым предметом, None - если общих уроков нет"""
+    shared = a.keys() & b.keys()
+    if not shared:
+        return None
+    return sum(a[slot] == b[slot] for slot in shared) / len(shared)
+
+
+def group_users(timetables: dict) -> list[list[int]]:
+    groups = []
+    for user_id, timetable in timetables.items():
+        for reference, members in groups:
+            ratio = agreement(reference, timetable)
+            if ratio is not None and ratio >= MATCH_RATIO:
+                members.append(user_id)
+                break
+        else:
+            groups.append((timetable, [user_id]))
+    return [members for _, members in groups]
+
+
+def class_timetable(timetables: list[dict]) -> dict:
+    common = set.intersection(*(set(timetable) for timetable in timetables))
+    return {
+        slot: Counter(timetable[slot] for timetable in timetables).most_common(1)[0][0]
+        for slot in common
+    }
+
+
+async def load_grade(conn, user_ids: list[int]) -> tuple[dict, dict, list]:
+    """Предметы, уроки и домашние задания пользователей одной параллели из старой схемы"""
+    subjects = defaultdict(dict)
+    lessons = {}
+    homework = []
+    for ids in chunked(user_ids, USERS_CHUNK_SIZE):
+        result = await conn.execute(select(legacy_subjects).where(legacy_subjects.c.user_id.in_(ids)))
+        subject_rows = result.all()
+        names = {row.id: row.name for row in subject_rows}
+        for row in subject_rows:
+            subjects[row.user_id][row.name] = row
+
+        result = await conn.execute(select(legacy_schedule).where(legacy_schedule.c.user_id.in_(ids)))
+        for row in result.all():
+            lessons[row.id] = (row.user_id, row.date, row.lesson_number, names.get(row.subject_id))
+
+        result = await conn.execute(
+            select(legacy_homework)
+            .join(legacy_schedule, legacy_schedule.c.id == legacy_homework.c.schedule_id)
+            .where(legacy_schedule.c.user_id.in_(ids))
+            .order_by(legacy_homework.c.id)
+        )
+        homework += result.all()
+    return subjects, lessons, homework
+
+
+def subject_row(subject_rows: list) -> dict:
+    # у разных учеников один предмет мог сохраниться с кабинетом или нагрузкой, а мог без
+    return {
+        "classroom": next((row.classroom for row in subject_rows if row.classroom), None),
+        "load_level": next((row.load_level for row in subject_rows if row.load_level), None),
+    }
+
+
+async def migrate_class(session, grade: str, members: list[int], users: dict, subjects: dict,
+                        timetables: dict, lesson_ids: dict, homework: list):
+    class_lessons = class_timetable([timetables[user_id] for user_id in members])
+
+    result = await session.execute(
+        insert(SchoolClass).values(school=f"legacy-{members[0]}", grade=grade).returning(SchoolClass.id)
+    )
+    class_id = result.scalar_one()
+
+    await session.execute(insert(User), [
+        {"id": user_id, "tg_id": users[user_id].tg_id, "grade": users[user_id].grade, "class_id": class_id}
+        for user_id in members
+    ])
+
+    class_subject_ids = {}
+    class_names = {name for name in class_lessons.values() if name is not None}
+    if class_names:
+        rows = [
+            {"class_id": class_id, "name": name,
+             **subject_row([subjects[user_id][name] for user_id in members if name in subjects[user_id]])}
+            for name in sorted(class_names)
+        ]
+        result = await session.execute(insert(Subject).values(rows).returning(Subject.id, Subject.name))
+        class_subject_ids = {name: subject_id for subject_id, name in result.all()}
+
+    user_subject_ids = {}
+    rows = [
+        {"user_id": user_id, "name": name, **subject_row([row])}
+        for user_id in members
+        for name, row in subjects[user_id].items()
+        if name not in class_names
+    ]
+    for chunk in chunked(rows):
+        result = await session.execute(
+            insert(Subject).values(chunk).returning(Subject.id, Subject.user_id, Subject.name)
+        )
+        user_subject_ids.update({(user_id, name): subject_id for subject_id, user_id, name in result.all()})
+
+    def subject_id(user_id: int | None, name: str | None) -> int | None:
+        if name is None:
+            return None
+        return class_subject_ids.get(name) or user_subject_ids[(user_id, name)]
+
+    new_lesson_ids = {}
+    rows = [
+        {"class_id": class_id, "date": date_obj, "lesson_number": number, "subject_id": subject_id(None, name)}
+        for (date_obj, number), name in class_lessons.items()
+    ]
+    for chunk in chunked(rows):
+        result = await session.execute(
+            insert(Schedule).values(chunk).returning(Schedule.id, Schedule.date, Schedule.lesson_number)
+        )
+        for schedule_id, date_obj, number in result.all():
+            for user_id in members:
+                new_lesson_ids[(user_id, date_obj, number)] = schedule_id
+
+    rows = [
+        {"user_id": user_id, "date": date_obj, "lesson_number": number, "subject_id": subject_id(user_id, name)}
+        for user_id in members
+        for (date_obj, number), name in timetables[user_id].items()
+        if (date_obj, number) not in class_lessons or class_lessons[(date_obj, number)] != name
+    ]
+    for chunk in chunked(rows):
+        result = await session.execute(
+            insert(Schedule).values(chunk)
+            .returning(Schedule.id, Schedule.user_id, Schedule.date, Schedule.lesson_number)
+        )
+        for schedule_id, user_id, date_obj, number in result.all():
+            new_lesson_ids[(user_id, date_obj, number)] = schedule_id
+
+    rows = []
+    for row in homework:
+        user_id, date_obj, number, _ = lesson_ids[row.schedule_id]
+        if user_id in members:
+            rows.append({
+                "schedule_id": new_lesson_ids[(user_id, date_obj, number)],
+                "user_id": user_id,
+                "text": row.text
+            })
+    for chunk in chunked(rows):
+        await session.execute(insert(Homework), chunk)
+
+    await refresh_day_loads(session, class_id)
+    return len(class_lessons), len(rows)
+
+
+async def copy_table(source, session, table):
+    columns = {column["name"] for column in await source.run_sync(
+        lambda conn: inspect(conn).get_columns(table.name)
+    )}
+    selected = [column for column in table.columns if column.name in columns]
+
+    result = await source.stream(select(*selected))
+    async for rows in result.partitions(1000):
+        await session.execute(insert(table), [dict(row._mapping) for row in rows])
+
+
+async def migrate_data(source, session_maker):
+    result = await source.execute(select(legacy_users).order_by(legacy_users.c.id))
+    users = {row.id: row for row in result.all()}
+
+    grades = defaultdict(list)
+    for user_id, row in users.items():
+        grades[normalize_grade(row.grade or "")].append(user_id)
+
+    for grade, user_ids in grades.items():
+        subjects, lesson_ids, homework = await load_grade(source, user_ids)
+        timetables = {user_id: {} for user_id in user_ids}
+        for user_id, date_obj, number, name in lesson_ids.values():
+            timetables[user_id][(date_obj, number)] = name
+
+        for members in group_users(timetables):
+            async with session_maker() as session:
+                lessons, homework_count = await migrate_class(
+                    session, grade, members, users, subjects, timetables, lesson_ids, homework
+                )
+                await session.commit()
+            print(f"{grade or '-'}: {len(members)} users, {lessons} class lessons, {homework_count} homework")
+
+    async with session_maker() as session:
+        for table in COPIED_TABLES:
+            if await source.run_sync(lambda conn: inspect(conn).has_table(table.name)):
+                await copy_table(source, session, table)
+
+        if session.bind.dialect.name == "postgresql":
+            # id пользователей, напоминаний и сообщений перенесены явно, сдвигаем последовательности за них
+            for table in ("users", "reminders", "outbox"):
+                await session.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 0) + 1 FROM {table}), false)"
+                ))
+        await session.commit()
+
+
+async def migrate(source_url: str, target_url: str):
+    source_engine = create_async_engine(source_url)
+    try:
+        async with source_engine.connect() as source:
+            version = await source.run_sync(stored_version)
+            if version is None:
+                raise RuntimeError("В исходной базе нет данных")
+            if version >= MIN_UPGRADABLE_VERSION:
+                raise RuntimeError(f"Исходная база уже версии {version}, переносить нечего")
+
+            target_engine = await init_db(target_url, mode="create")
+            try:
+                async with target_engine.connect() as target:
+                    if await target.scalar(select(User.id).limit(1)) is not None:
+                        raise RuntimeError("Целевая база должна быть пустой")
+
+                await migrate_data(source, get_session_maker(target_engine))
+            finally:
+                await target_engine.dispose()
+    finally:
+        await source_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", required=True, help="база со старой схемой, не меняется")
+    parser.add_argument("--target", required=True, help="новая пустая база")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.source, args.target))
+
+
+if __name__ == "__main__":
+    main()
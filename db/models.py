@@ -4,30 +4,64 @@ from sqlalchemy import (
     BigInteger,
     String,
     Date,
+    DateTime,
+    Float,
     Text,
     ForeignKey,
     UniqueConstraint,
+    CheckConstraint,
+    Index,
+    text,
 )
 from sqlalchemy.orm import relationship
 from db.core import Base
 
 
+class SchoolClass(Base):
+    __tablename__ = "classes"
+
+    id = Column(Integer, primary_key=True)
+    school = Column(String(255), nullable=False, default="")
+    grade = Column(String(50), nullable=False)
+
+    users = relationship("User", back_populates="school_class")
+
+    __table_args__ = (
+        UniqueConstraint("school", "grade", name="uq_school_grade"),
+    )
+
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
     tg_id = Column(BigInteger, unique=True, nullable=False)
 
+    school = Column(String)
     grade = Column(String)
+    class_id = Column(Integer, ForeignKey("classes.id"))
+
+    school_class = relationship("SchoolClass", back_populates="users")
     subjects = relationship("Subject", back_populates="user", cascade="all, delete")
     schedule = relationship("Schedule", back_populates="user", cascade="all, delete")
+    homework = relationship("Homework", back_populates="user", cascade="all, delete")
+    day_loads = relationship("DayLoad", back_populates="user", cascade="all, delete")
 
+    __table_args__ = (
+        # пересчёт сводок класса обходит его учеников
+        Index("ix_users_class_id", "class_id"),
+    )
+
+
+# Предметы, уроки и сводки нагрузки принадлежат либо классу (общее расписание),
+# либо пользователю (его собственные предметы и изменения поверх расписания класса).
 
 class Subject(Base):
     __tablename__ = "subjects"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    class_id = Column(Integer, ForeignKey("classes.id", ondelete="CASCADE"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
 
     name = Column(String(255), nullable=False)
     classroom = Column(String(50))
@@ -38,7 +72,12 @@ class Subject(Base):
     load_level = Column(Integer)
 
     __table_args__ = (
+        UniqueConstraint("class_id", "name", name="uq_class_subject_name"),
         UniqueConstraint("user_id", "name", name="uq_user_subject_name"),
+        CheckConstraint("(class_id IS NULL) <> (user_id IS NULL)", name="ck_subject_owner"),
+        # почти у всех предметов user_id пуст, по полному индексу планировщик считает поиск дороже перебора
+        Index("ix_subjects_user_own", "user_id",
+              sqlite_where=text("user_id IS NOT NULL"), postgresql_where=text("user_id IS NOT NULL")),
     )
 
 
@@ -47,7 +86,9 @@ class Schedule(Base):
 
     id = Column(Integer, primary_key=True)
 
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    class_id = Column(Integer, ForeignKey("classes.id", ondelete="CASCADE"))
+    # строка пользователя заменяет урок класса с тем же номером, subject_id NULL - урок отменён
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     date = Column(Date, nullable=False)
     lesson_number = Column(Integer, nullable=False)
     subject_id = Column(Integer, ForeignKey("subjects.id", ondelete="SET NULL"))
@@ -57,8 +98,13 @@ class Schedule(Base):
     homework = relationship("Homework", back_populates="schedule", cascade="all, delete")
 
     __table_args__ = (
+        UniqueConstraint("class_id", "date", "lesson_number",
+                         name="uq_class_day_lesson"),
         UniqueConstraint("user_id", "date", "lesson_number",
                          name="uq_user_day_lesson"),
+        CheckConstraint("(class_id IS NULL) <> (user_id IS NULL)", name="ck_schedule_owner"),
+        # ON DELETE SET NULL при удалении предмета
+        Index("ix_schedule_subject_id", "subject_id"),
     )
 
 
@@ -71,7 +117,87 @@ class Homework(Base):
         ForeignKey("schedule.id", ondelete="CASCADE"),
         nullable=False
     )
+    # урок может быть общим для класса, а задание у каждого своё
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
 
     text = Column(Text, nullable=True)
 
-    schedule = relationship("Schedule", back_populates="homework")
\ No newline at end of file
+    schedule = relationship("Schedule", back_populates="homework")
+    user = relationship("User", back_populates="homework")
+
+    __table_args__ = (
+        Index("ix_homework_user_schedule", "user_id", "schedule_id"),
+        Index("ix_homework_schedule_id", "schedule_id"),
+    )
+
+
+class DayLoad(Base):
+    __tablename__ = "day_loads"
+
+    id = Column(Integer, primary_key=True)
+
+    class_id = Column(Integer, ForeignKey("classes.id", ondelete="CASCADE"))
+    # есть только на дни, где у пользователя свои изменения расписания
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    date = Column(Date, nullable=False)
+
+    # по урокам с предметом, пересчитывается при импорте и изменении расписания
+    avg_load = Column(Float)
+    max_load = Column(Integer)
+    lesson_count = Column(Integer, nullable=False)
+
+    user = relationship("User", back_populates="day_loads")
+
+    __table_args__ = (
+        UniqueConstraint("class_id", "date", name="uq_class_day_load"),
+        UniqueConstraint("user_id", "date", name="uq_user_day_load"),
+        CheckConstraint("(class_id IS NULL) <> (user_id IS NULL)", name="ck_day_load_owner"),
+    )
+
+
+class Reminder(Base):
+    __tablename__ = "reminders"
+
+    id = Column(Integer, primary_key=True)
+    # один и тот же запрос из очереди может прийти повторно
+    dedup_key = Column(String(64), unique=True, nullable=False)
+
+    tg_id = Column(BigInteger, nullable=False)
+    remind_at = Column(DateTime, nullable=False)
+    text = Column(Text, nullable=False)
+
+    locked_until = Column(DateTime)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_reminders_pending", "sent_at", "remind_at"),
+    )
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True)
+    routing_key = Column(String(255), nullable=False)
+    payload = Column(Text, nullable=False)
+
+    created_at = Column(DateTime, nullable=False)
+    published_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_outbox_unpublished", "published_at", "id"),
+    )
+
+
+class FSMState(Base):
+    __tablename__ = "fsm_states"
+
+    key = Column(String(255), primary_key=True)
+    state = Column(String(255))
+    data = Column(Text)
+
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_fsm_states_updated_at", "updated_at"),
+    )
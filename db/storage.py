@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from json import dumps, loads
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from sqlalchemy import delete, select
+
+from db.cache import TTLCache
+from db.database import upsert
+from db.models import FSMState
+
+# кэш верен, только пока все изменения проходят через этот процесс, при нескольких процессах его отключают
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "3600"))
+# незавершённые диалоги старше этого срока удаляются
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(7 * 24 * 3600)))
+FSM_CLEANUP_INTERVAL = float(os.getenv("FSM_CLEANUP_INTERVAL", "3600"))
+
+
+class DatabaseStorage(BaseStorage):
+    """Хранит состояния FSM в таблице fsm_states, чтобы их видели все процессы бота"""
+
+    def __init__(self, key_builder: Optional[DefaultKeyBuilder] = None, cache_ttl: float = FSM_CACHE_TTL):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.session_maker = None
+        # 0 - без кэша: состояние могло измениться в другом процессе
+        self.cache = TTLCache(max_size=FSM_CACHE_SIZE, ttl=cache_ttl) if cache_ttl > 0 else None
+        self.task = None
+
+    def start(self, session_maker):
+        self.session_maker = session_maker
+        self.task = asyncio.create_task(self.run_cleanup())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def load(self, key: str) -> tuple:
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            return cached
+
+        async with self.session_maker() as session:
+            result = await session.execute(
+                select(FSMState.state, FSMState.data).filter_by(key=key)
+            )
+            row = result.one_or_none()
+
+        # отсутствие состояния тоже кэшируем, это самый частый случай
+        entry = (row.state, loads(row.data) if row.data else {}) if row else (None, {})
+        if self.cache is not None:
+            self.cache.set(key, entry)
+        return entry
+
+    async def save(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        async with self.session_maker() as session:
+            if state is None and not data:
+                await session.execute(delete(FSMState).filter_by(key=key))
+            else:
+                stmt = upsert(session, FSMState).values(
+                    key=key,
+                    state=state,
+                    data=dumps(data, ensure_ascii=False),
+                    updated_at=datetime.now()
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[FSMState.key],
+                    set_={
+                        "state": stmt.excluded.state,
+                        "data": stmt.excluded.data,
+                        "updated_at": stmt.excluded.updated_at,
+                    }
+                )
+                await session.execute(stmt)
+            await session.commit()
+
+        if self.cache is not None:
+            self.cache.set(key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key = self.key_builder.build(key)
+        _, data = await self.load(db_key)
+        await self.save(db_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self.load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        db_key = self.key_builder.build(key)
+        state, _ = await self.load(db_key)
+        await self.save(db_key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self.load(self.key_builder.build(key))
+        return dict(data)
+
+    async def cleanup(self) -> int:
+        expired = datetime.now() - timedelta(seconds=FSM_STATE_TTL)
+        async with self.session_maker() as session:
+            result = await session.execute(
+                delete(FSMState).where(FSMState.updated_at < expired)
+            )
+            await session.commit()
+
+        # в кэше могли остаться удалённые состояния
+        if result.rowcount and self.cache is not None:
+            self.cache.clear()
+        return result.rowcount
+
+    async def run_cleanup(self):
+        while True:
+            try:
+                removed = await self.cleanup()
+                if removed:
+                    logging.info(f"Removed {removed} stale FSM states")
+            except Exception as e:
+                logging.error(f"FSM cleanup error: {e}")
+            await asyncio.sleep(FSM_CLEANUP_INTERVAL)
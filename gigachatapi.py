@@ -1,42 +1,71 @@
+import asyncio
+import logging
 import os
+import re
+import time
 
 from datetime import date
-from gigachat import GigaChat
+from gigachat.client import GigaChatAsyncClient
 from gigachat.models import Chat, Messages, MessagesRole
 
 from dotenv import load_dotenv
+from json import loads
 
 from db.database import get_all_user_subjects
+from intent_cache import intent_cache
+from intent_rules import match_intent
+from metrics import span
 
 load_dotenv()
 
 API_KEY = os.getenv("API_KEY")
+GIGACHAT_MAX_CONNECTIONS = int(os.getenv("GIGACHAT_MAX_CONNECTIONS", "10"))
+GIGACHAT_MAX_CONCURRENCY = int(os.getenv("GIGACHAT_MAX_CONCURRENCY", "10"))
+GIGACHAT_TIMEOUT = float(os.getenv("GIGACHAT_TIMEOUT", "30"))
+# за сколько секунд до истечения токена запрашивать новый
+GIGACHAT_TOKEN_REFRESH_MARGIN = int(os.getenv("GIGACHAT_TOKEN_REFRESH_MARGIN", "60"))
 
 
-payload_base = Chat(
-    messages=[
-        Messages(
-            role=MessagesRole.SYSTEM,
-            content="действуй железно и четко, как очень умный алгоритм, а не нейросеть"
-        )
-    ],
-)
+class CachedTokenGigaChat(GigaChatAsyncClient):
+    def _check_validity_token(self) -> bool:
+        if self._access_token is None:
+            return False
+        # expires_at == 0 у токена, переданного напрямую через access_token
+        if not self._access_token.expires_at:
+            return True
+        expires_at = self._access_token.expires_at / 1000
+        return time.time() < expires_at - GIGACHAT_TOKEN_REFRESH_MARGIN
 
-weekdays = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+giga = None
+giga_semaphore = None
+
+
+def init_gigachat():
+    """Токен не запрашивается сразу: клиент получит его при первом запросе,
+    поэтому недоступность авторизации GigaChat не мешает запуску бота"""
+    global giga, giga_semaphore
+
+    giga = CachedTokenGigaChat(
+        credentials=API_KEY,
+        verify_ssl_certs=False,
+        timeout=GIGACHAT_TIMEOUT,
+        max_connections=GIGACHAT_MAX_CONNECTIONS,
+    )
+    giga_semaphore = asyncio.Semaphore(GIGACHAT_MAX_CONCURRENCY)
+    return giga
 
 
-async def get_answer(session, text: str, tg_id) -> str:
-    with GigaChat(credentials=API_KEY, verify_ssl_certs=False) as giga:
-        payload = payload_base.copy()
-        payload.messages.append(Messages(
-            role=MessagesRole.USER,
-            content=f"""Проанализируй запрос пользователя и верни ТОЛЬКО JSON без дополнительного текста.
+async def close_gigachat():
+    global giga
 
-ЗАПРОС ПОЛЬЗОВАТЕЛЯ: {text}
-ТЕКУЩАЯ ДАТА: {date.today().strftime("%d/%m/%Y")}, {weekdays[date.today().weekday()]}
+    if giga is not None:
+        await giga.aclose()
+        giga = None
 
-ДОСТУПНЫЕ ПРЕДМЕТЫ ПОЛЬЗОВАТЕЛЯ:
-{", ".join((i['name'] for i in await get_all_user_subjects(session, tg_id)))}
+
+PROMPT_INSTRUCTIONS = """Проанализируй запрос пользователя и верни ТОЛЬКО JSON без дополнительного текста.
+Запрос, текущая дата и доступные предметы пользователя приходят отдельным сообщением.
 
 ПРАВИЛА КЛАССИФИКАЦИИ:
 
@@ -44,26 +73,32 @@ async def get_answer(session, text: str, tg_id) -> str:
    Когда: пользователь запрашивает все уроки на определенный день
    Примеры: "расписание на завтра", "что у меня в понедельник", "покажи уроки на 28 ноября"
    Формат ответа:
-   {{"type": "schedule", "date": "дата в формате ДД/ММ/ГГГГ"}}
+   {"type": "schedule", "date": "дата в формате ДД/ММ/ГГГГ"}
+
+2. ТИП: РАСПИСАНИЕ НА ПЕРИОД
+   Когда: пользователь запрашивает уроки сразу на несколько дней
+   Примеры: "расписание на неделю", "что у меня на следующей неделе", "уроки до пятницы", "расписание на четверть"
+   Формат ответа:
+   {"type": "schedule_range", "date_from": "первый день в формате ДД/ММ/ГГГГ", "date_to": "последний день в формате ДД/ММ/ГГГГ"}
 
-2. ТИП: КОНКРЕТНЫЙ УРОК
+3. ТИП: КОНКРЕТНЫЙ УРОК
    Когда: пользователь спрашивает про один конкретный урок
    Примеры: "какой 3 урок завтра", "что на 5 паре сегодня", "следующий урок"
    Формат ответа:
-   {{"type": "lesson", "date": "дата в формате ДД/ММ/ГГГГ", "lesson_number": номер_урока_или_None}}
+   {"type": "lesson", "date": "дата в формате ДД/ММ/ГГГГ", "lesson_number": номер_урока_или_None}
    
    ВАЖНО: lesson_number = None (именно None, не null), если:
    - пользователь написал "следующий урок" и дата = сегодняшняя дата
    - номер урока явно не указан, но подразумевается текущий/следующий
 
-3. ТИП: ДОБАВЛЕНИЕ ДОМАШНЕГО ЗАДАНИЯ
+4. ТИП: ДОБАВЛЕНИЕ ДОМАШНЕГО ЗАДАНИЯ
    Когда: пользователь добавляет домашнее задание по предмету на определенную дату
    Примеры: 
-   - "На завтра по математике упражнение 45 и 46" → subject_name: "алгебра" (если алгебра в списке выше)
-   - "Домашка на понедельник: биология параграф 12" → subject_name: "биолог" (если биолог в списке выше)
+   - "На завтра по математике упражнение 45 и 46" → subject_name: "алгебра" (если алгебра есть в ДОСТУПНЫХ ПРЕДМЕТАХ)
+   - "Домашка на понедельник: биология параграф 12" → subject_name: "биолог" (если биолог есть в ДОСТУПНЫХ ПРЕДМЕТАХ)
    - "На 28 ноября по физике решить задачи 1-10" → subject_name: "физика"
    Формат ответа:
-   {{"type": "add_homework", "date": "дата в формате ДД/ММ/ГГГГ", "subject_name": "точное название из списка выше", "text": "текст домашнего задания"}}
+   {"type": "add_homework", "date": "дата в формате ДД/ММ/ГГГГ", "subject_name": "точное название из ДОСТУПНЫХ ПРЕДМЕТОВ", "text": "текст домашнего задания"}
    
    КРИТИЧЕСКИ ВАЖНО для subject_name:
    - Используй ТОЛЬКО названия предметов из списка "ДОСТУПНЫЕ ПРЕДМЕТЫ ПОЛЬЗОВАТЕЛЯ"
@@ -76,7 +111,7 @@ async def get_answer(session, text: str, tg_id) -> str:
    - В поле text помести ТОЛЬКО описание задания
    - Убери из text дату, предмет и слова "на", "по", "домашка"
 
-4. ТИП: ПРОСМОТР ДОМАШНЕГО ЗАДАНИЯ
+5. ТИП: ПРОСМОТР ДОМАШНЕГО ЗАДАНИЯ
    Когда: пользователь запрашивает домашнее задание на определенную дату
    Примеры:
    - "какое дз на завтра"
@@ -84,13 +119,22 @@ async def get_answer(session, text: str, tg_id) -> str:
    - "покажи домашнее задание на 28 ноября"
    - "что задали на завтра"
    Формат ответа:
-   {{"type": "get_homework", "date": "дата в формате ДД/ММ/ГГГГ"}}
+   {"type": "get_homework", "date": "дата в формате ДД/ММ/ГГГГ"}
    
    ВАЖНО:
    - Этот тип используется ТОЛЬКО для просмотра/получения домашки
    - Если пользователь добавляет/записывает дз - используй тип "add_homework"
 
-5. ТИП: ИЗМЕНЕНИЕ РАСПИСАНИЯ
+6. ТИП: ДОМАШНЕЕ ЗАДАНИЕ НА ПЕРИОД
+   Когда: пользователь запрашивает домашнее задание сразу на несколько дней
+   Примеры:
+   - "всё дз до пятницы"
+   - "что задали на эту неделю"
+   - "домашка на следующую неделю"
+   Формат ответа:
+   {"type": "get_homework_range", "date_from": "первый день в формате ДД/ММ/ГГГГ", "date_to": "последний день в формате ДД/ММ/ГГГГ"}
+
+7. ТИП: ИЗМЕНЕНИЕ РАСПИСАНИЯ
    Когда: пользователь сообщает об изменениях в расписании (замена урока или отмена)
    Примеры:
    - "завтра вместо химии математика" → замена химии на математику
@@ -98,7 +142,7 @@ async def get_answer(session, text: str, tg_id) -> str:
    - "в понедельник физику заменили на географию" → замена физики на географию
    - "28 ноября биологии не будет" → отмена биологии
    Формат ответа:
-   {{"type": "edit_schedule", "changes": [{{"date": "дата в формате ДД/ММ/ГГГГ", "subject_from": "название предмета из списка", "subject_to": "название предмета из списка или ---"}}]}}
+   {"type": "edit_schedule", "changes": [{"date": "дата в формате ДД/ММ/ГГГГ", "subject_from": "название предмета из списка", "subject_to": "название предмета из списка или ---"}]}
    
    КРИТИЧЕСКИ ВАЖНО:
    - Используй ТОЛЬКО предметы из списка "ДОСТУПНЫЕ ПРЕДМЕТЫ ПОЛЬЗОВАТЕЛЯ"
@@ -109,7 +153,7 @@ async def get_answer(session, text: str, tg_id) -> str:
    - Массив changes может содержать несколько изменений, если их указано в запросе
    - Если предметы не найдены в списке - используй type: "undetected"
 
-6. ТИП: УСТАНОВКА НАПОМИНАНИЯ
+8. ТИП: УСТАНОВКА НАПОМИНАНИЯ
    Когда: пользователь просит напомнить о чем-то в определенное время
    Примеры:
    - "напомни мне завтра в 15:00 сделать домашку"
@@ -117,7 +161,7 @@ async def get_answer(session, text: str, tg_id) -> str:
    - "напомни в 14:00 сегодня позвонить маме"
    - "уведоми меня 28 ноября в 10:00 о встрече"
    Формат ответа:
-   {{"type": "notify", "datetime": "дата и время в формате ДД/ММ/ГГГГ ЧЧ:ММ", "text": "текст напоминания"}}
+   {"type": "notify", "datetime": "дата и время в формате ДД/ММ/ГГГГ ЧЧ:ММ", "text": "текст напоминания"}
    
    ВАЖНО для напоминаний:
    - datetime должен содержать ОБЯЗАТЕЛЬНО и дату и время в формате "ДД/ММ/ГГГГ ЧЧ:ММ"
@@ -125,11 +169,11 @@ async def get_answer(session, text: str, tg_id) -> str:
    - В поле text помести то, о чем нужно напомнить (без даты и времени)
    - Примеры datetime: "28/11/2025 15:00", "01/12/2025 08:30"
 
-7. ТИП: ЗАПРОС НЕ РАСПОЗНАН
+9. ТИП: ЗАПРОС НЕ РАСПОЗНАН
    Когда: запрос не относится к расписанию, урокам, домашнему заданию, напоминаниям ИЛИ предмет не найден в списке
    Примеры: "привет", "как дела", "сколько будет 2+2", "по непонятному предмету задание"
    Формат ответа:
-   {{"type": "undetected"}}
+   {"type": "undetected"}
 
 ПРАВИЛА ОБРАБОТКИ ДАТ:
 - "сегодня" = текущая дата
@@ -137,6 +181,9 @@ async def get_answer(session, text: str, tg_id) -> str:
 - "послезавтра" = текущая дата + 2 дня
 - "понедельник", "вторник", "среду" и т.д. = ближайший такой день недели от текущей даты
 - Конкретная дата "28 ноября" = преобразуй в формат ДД/ММ/ГГГГ текущего или следующего года
+- "эта неделя" = с текущей даты по воскресенье, "следующая неделя" = с её понедельника по воскресенье
+- "до пятницы", "до 28 ноября" = с текущей даты по этот день включительно
+- Если период - один день, используй "schedule" или "get_homework", а не тип для периода
 
 ПРАВИЛА ОБРАБОТКИ ВРЕМЕНИ:
 - Если указано точное время "в 15:00", "в 8:30" - используй его
@@ -147,17 +194,119 @@ async def get_answer(session, text: str, tg_id) -> str:
 - Возвращай ТОЛЬКО валидный JSON, без пояснений, без markdown блоков
 - Все значения полей на РУССКОМ языке
 - Если не уверен в классификации → используй тип "undetected"
-- В поле date ВСЕГДА формат ДД/ММ/ГГГГ
+- В полях date, date_from и date_to ВСЕГДА формат ДД/ММ/ГГГГ
 - В поле datetime ВСЕГДА формат ДД/ММ/ГГГГ ЧЧ:ММ
 - В поле lesson_number пиши None (не "None", не null)
 - subject_name/subject_from/subject_to должны ТОЧНО совпадать с предметами из списка "ДОСТУПНЫЕ ПРЕДМЕТЫ"
-- Если предмет не найден в списке - вернуть {{"type": "undetected"}}
+- Если предмет не найден в списке - вернуть {"type": "undetected"}
 - Различай "add_homework" (добавление дз) и "get_homework" (просмотр дз)
+- Различай один день ("schedule", "get_homework") и период ("schedule_range", "get_homework_range")
 - Для изменений расписания используй "---" для отмены урока
 """
 
+PROMPT_INSTRUCTIONS_COMPACT = """Классифицируй запрос школьника. Верни ТОЛЬКО JSON одного из видов:
+{"type": "schedule", "date": "ДД/ММ/ГГГГ"} - все уроки на день
+{"type": "schedule_range", "date_from": "ДД/ММ/ГГГГ", "date_to": "ДД/ММ/ГГГГ"} - уроки на несколько дней (неделя, "до пятницы")
+{"type": "lesson", "date": "ДД/ММ/ГГГГ", "lesson_number": N} - один урок; None, если номер не указан ("следующий урок")
+{"type": "add_homework", "date": "ДД/ММ/ГГГГ", "subject_name": "предмет", "text": "только текст задания"}
+{"type": "get_homework", "date": "ДД/ММ/ГГГГ"} - просмотр дз
+{"type": "get_homework_range", "date_from": "ДД/ММ/ГГГГ", "date_to": "ДД/ММ/ГГГГ"} - дз на несколько дней
+{"type": "edit_schedule", "changes": [{"date": "ДД/ММ/ГГГГ", "subject_from": "предмет", "subject_to": "предмет или ---"}]} - замена или отмена ("---")
+{"type": "notify", "datetime": "ДД/ММ/ГГГГ ЧЧ:ММ", "text": "о чем напомнить"}
+{"type": "undetected"} - всё остальное или предмет не найден
+Предметы - ТОЛЬКО из ДОСТУПНЫХ ПРЕДМЕТОВ, ближайший по смыслу (матем/мат->алгебра, рус->рус.яз, англ->англ.яз, геом->геомет).
+Даты: сегодня, завтра=+1, послезавтра=+2, день недели=ближайший такой день, "28 ноября"=текущий или следующий год.
+Периоды: эта неделя=с сегодня по воскресенье, следующая неделя=с понедельника по воскресенье, "до пятницы"=с сегодня по пятницу.
+Время: утром 09:00, днем 14:00, вечером 18:00, ночью 22:00, по умолчанию 09:00.
+Без пояснений и markdown, lesson_number пиши None (не null).
+"""
+
+PROMPT_COMPACT = os.getenv("GIGACHAT_COMPACT_PROMPT", "0") == "1"
+
+payload_base = Chat(
+    messages=[
+        Messages(
+            role=MessagesRole.SYSTEM,
+            content="действуй железно и четко, как очень умный алгоритм, а не нейросеть\n\n"
+                    + (PROMPT_INSTRUCTIONS_COMPACT if PROMPT_COMPACT else PROMPT_INSTRUCTIONS)
+        )
+    ],
+)
+
+prompt_stats = {
+    "calls": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "precached_prompt_tokens": 0,
+    "latency": 0.0,
+}
+
+weekdays = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def record_usage(usage, latency: float):
+    prompt_stats["calls"] += 1
+    prompt_stats["prompt_tokens"] += usage.prompt_tokens
+    prompt_stats["completion_tokens"] += usage.completion_tokens
+    prompt_stats["precached_prompt_tokens"] += usage.precached_prompt_tokens or 0
+    prompt_stats["latency"] += latency
+    logging.info(
+        f"GigaChat call: prompt_tokens={usage.prompt_tokens} completion_tokens={usage.completion_tokens} "
+        f"precached_prompt_tokens={usage.precached_prompt_tokens} latency={latency:.3f}s compact={PROMPT_COMPACT}"
+    )
+
+
+def get_prompt_stats() -> dict:
+    calls = prompt_stats["calls"]
+    return {
+        **prompt_stats,
+        "avg_prompt_tokens": prompt_stats["prompt_tokens"] / calls if calls else 0.0,
+        "avg_completion_tokens": prompt_stats["completion_tokens"] / calls if calls else 0.0,
+        "avg_latency": prompt_stats["latency"] / calls if calls else 0.0,
+    }
+
+
+def parse_answer(answer: str) -> dict:
+    answer = answer.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    # модель по инструкции пишет lesson_number: None, это не валидный JSON
+    return loads(re.sub(r"\bNone\b", "null", answer))
+
+
+async def get_answer(session, text: str | None, tg_id) -> dict:
+    # стикеры, фото и другие сообщения без текста
+    if not text or not text.strip():
+        return {"type": "undetected"}
+
+    today = date.today()
+    json_data = match_intent(text, today)
+    if json_data is not None:
+        return json_data
+
+    subjects = [i['name'] for i in await get_all_user_subjects(session, tg_id)]
+
+    cache_key = intent_cache.make_key(text, today, subjects)
+    cached = intent_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # без await между проверкой и созданием клиента, поэтому два запроса не создадут два клиента
+    if giga is None:
+        init_gigachat()
+
+    payload = Chat(messages=[*payload_base.messages])
+    payload.messages.append(Messages(
+        role=MessagesRole.USER,
+        content=f"ЗАПРОС ПОЛЬЗОВАТЕЛЯ: {text}\n"
+                f"ТЕКУЩАЯ ДАТА: {today.strftime('%d/%m/%Y')}, {weekdays[today.weekday()]}\n"
+                f"ДОСТУПНЫЕ ПРЕДМЕТЫ ПОЛЬЗОВАТЕЛЯ: {', '.join(subjects)}"
+    ))
+    async with giga_semaphore:
+        with span("gigachat") as call:
+            response = await giga.achat(payload)
+        latency = call.elapsed
+
+    record_usage(response.usage, latency)
 
-))
-        response = giga.chat(payload)
-        payload.messages.append(response.choices[0].message)
-        return response.choices[0].message.content 
+    json_data = parse_answer(response.choices[0].message.content)
+    intent_cache.set(cache_key, json_data)
+    return json_data
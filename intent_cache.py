@@ -0,0 +1,50 @@
+import hashlib
+import os
+import re
+from copy import deepcopy
+from datetime import date, datetime, time, timedelta
+
+from db.cache import TTLCache
+
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "5000"))
+
+
+def normalize_text(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s:/.-]", " ", text)
+    return " ".join(text.split())
+
+
+def subjects_hash(subjects: list[str]) -> str:
+    return hashlib.sha1("\n".join(sorted(subjects)).encode()).hexdigest()
+
+
+def next_midnight() -> float:
+    return datetime.combine(date.today() + timedelta(days=1), time.min).timestamp()
+
+
+class IntentCache(TTLCache):
+    """Записи живут до полуночи: "завтра" в ключе верно только до конца дня"""
+
+    def __init__(self, max_size: int = INTENT_CACHE_SIZE):
+        super().__init__(max_size, ttl=0)
+
+    @staticmethod
+    def make_key(text: str, today: date, subjects: list[str]) -> tuple:
+        return normalize_text(text), today.isoformat(), subjects_hash(subjects)
+
+    def now(self) -> float:
+        return datetime.now().timestamp()
+
+    def expires_at(self) -> float:
+        return next_midnight()
+
+    def get(self, key: tuple) -> dict | None:
+        intent = super().get(key)
+        return deepcopy(intent) if intent is not None else None
+
+    def set(self, key: tuple, intent: dict, generation: int | None = None):
+        super().set(key, deepcopy(intent), generation)
+
+
+intent_cache = IntentCache()
@@ -0,0 +1,186 @@
+import re
+from datetime import date, timedelta
+
+from intent_cache import normalize_text
+
+WEEKDAYS = {
+    "понедельник": 0,
+    "вторник": 1,
+    "среда": 2, "среду": 2,
+    "четверг": 3,
+    "пятница": 4, "пятницу": 4,
+    "суббота": 5, "субботу": 5,
+    "воскресенье": 6,
+    # после "до": "дз до пятницы"
+    "понедельника": 0, "вторника": 1, "среды": 2, "четверга": 3,
+    "пятницы": 4, "субботы": 5, "воскресенья": 6,
+}
+
+MONTHS = {
+    "января": 1, "февраля": 2, "марта": 3, "апреля": 4, "мая": 5, "июня": 6,
+    "июля": 7, "августа": 8, "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12,
+}
+
+RELATIVE_DAYS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+
+WEEK_WORDS = {"неделю", "неделе", "неделя", "недели"}
+THIS_WEEK_WORDS = {"эту", "этой", "эта", "текущую", "текущей"}
+NEXT_WEEK_WORDS = {"следующую", "следующей", "следующая"}
+
+ORDINALS = {
+    "первый": 1, "первом": 1, "первая": 1, "первой": 1,
+    "второй": 2, "втором": 2, "вторая": 2,
+    "третий": 3, "третьем": 3, "третья": 3, "третьей": 3,
+    "четвертый": 4, "четвертом": 4, "четвертая": 4, "четвертой": 4,
+    "пятый": 5, "пятом": 5, "пятая": 5, "пятой": 5,
+    "шестой": 6, "шестом": 6, "шестая": 6,
+    "седьмой": 7, "седьмом": 7, "седьмая": 7,
+    "восьмой": 8, "восьмом": 8, "восьмая": 8,
+}
+
+SCHEDULE_WORDS = {"расписание", "расписания", "уроки", "уроков", "пары"}
+HOMEWORK_WORDS = {"дз", "домашка", "домашку", "домашки", "домашнее", "домашнего", "задание", "задания", "задали"}
+# "урока" и "пары" не берём: "у меня 2 урока завтра" - это не вопрос про второй урок
+LESSON_WORDS = {"урок", "уроке", "паре"}
+FILLER_WORDS = {
+    "а", "в", "во", "на", "у", "меня", "мне", "мое", "мои", "что", "какое", "какие", "какой", "какая",
+    "покажи", "скажи", "дай", "пожалуйста", "будет", "есть", "по", "счету", "будут",
+}
+
+DATE_RE = re.compile(r"^(\d{1,2})[./](\d{1,2})(?:[./](\d{2}|\d{4}))?$")
+# "28.11" без года считается датой только после предлога, иначе это может быть номер упражнения ("дз 1.5")
+DATE_PREPOSITIONS = {"на", "до", "к"}
+
+stats = {"total": 0, "handled": 0}
+
+
+def _resolve_day_month(day: int, month: int, today: date) -> date | None:
+    try:
+        result = date(today.year, month, day)
+    except ValueError:
+        return None
+    if result < today:
+        try:
+            result = date(today.year + 1, month, day)
+        except ValueError:
+            return None
+    return result
+
+
+def extract_date(tokens: list[str], today: date) -> tuple[date | None, list[str]]:
+    """Находит в запросе одну дату и возвращает её вместе с оставшимися словами"""
+    found = None
+    rest = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        value = None
+        step = 1
+
+        if token in RELATIVE_DAYS:
+            value = today + timedelta(days=RELATIVE_DAYS[token])
+        elif token in WEEKDAYS:
+            value = today + timedelta(days=(WEEKDAYS[token] - today.weekday()) % 7)
+        elif token.isdigit() and i + 1 < len(tokens) and tokens[i + 1] in MONTHS:
+            value = _resolve_day_month(int(token), MONTHS[tokens[i + 1]], today)
+            step = 2
+        elif match := DATE_RE.match(token):
+            day, month, year = match.groups()
+            if year:
+                year = int(year) + 2000 if len(year) == 2 else int(year)
+                try:
+                    value = date(year, int(month), int(day))
+                except ValueError:
+                    value = None
+            elif i > 0 and tokens[i - 1] in DATE_PREPOSITIONS:
+                value = _resolve_day_month(int(day), int(month), today)
+
+        if value is not None:
+            if found is not None and found != value:
+                return None, tokens
+            found = value
+        else:
+            rest.append(token)
+        i += step
+
+    return found, rest
+
+
+def extract_week(tokens: list[str], today: date) -> tuple[tuple[date, date] | None, list[str]]:
+    """Находит "на (эту|следующую) неделю": эта неделя - с сегодня до воскресенья, следующая - целиком"""
+    for i, token in enumerate(tokens):
+        if token not in WEEK_WORDS:
+            continue
+        previous = tokens[i - 1] if i > 0 else None
+        sunday = today + timedelta(days=6 - today.weekday())
+        if previous in NEXT_WEEK_WORDS:
+            week = (sunday + timedelta(days=1), sunday + timedelta(days=7))
+        else:
+            week = (today, sunday)
+        skip = {i, i - 1} if previous in NEXT_WEEK_WORDS | THIS_WEEK_WORDS else {i}
+        return week, [t for k, t in enumerate(tokens) if k not in skip]
+    return None, tokens
+
+
+def extract_lesson_number(tokens: list[str]) -> tuple[int | None, list[str]]:
+    for i, token in enumerate(tokens):
+        if token not in LESSON_WORDS:
+            continue
+        for j in (i - 1, i + 1):
+            if 0 <= j < len(tokens):
+                number = int(tokens[j]) if tokens[j].isdigit() else ORDINALS.get(tokens[j])
+                if number:
+                    rest = [t for k, t in enumerate(tokens) if k not in (i, j)]
+                    return number, rest
+    return None, tokens
+
+
+def match_intent(text: str, today: date) -> dict | None:
+    """Распознаёт простые запросы без обращения к модели, None - если не уверен"""
+    stats["total"] += 1
+    if not text:
+        return None
+
+    tokens = [t.strip(".:/-") for t in normalize_text(text).split()]
+    period, tokens = extract_week(tokens, today)
+    target_date, tokens = extract_date(tokens, today)
+    result = None
+
+    # "до пятницы" - с сегодняшнего дня по этот день
+    if period is None and target_date is not None and "до" in tokens:
+        period = (today, target_date)
+        tokens = [t for t in tokens if t != "до"]
+
+    if period is not None:
+        words = set(tokens)
+        # неделя вместе с отдельной датой - непонятно, какой период имелся в виду
+        if target_date is not None and period[1] != target_date:
+            words = {None}
+        date_from, date_to = (d.strftime("%d/%m/%Y") for d in period)
+
+        if words & HOMEWORK_WORDS and words <= HOMEWORK_WORDS | FILLER_WORDS:
+            result = {"type": "get_homework_range", "date_from": date_from, "date_to": date_to}
+        elif words <= SCHEDULE_WORDS | FILLER_WORDS and (words & SCHEDULE_WORDS or words & {"что", "у"}):
+            result = {"type": "schedule_range", "date_from": date_from, "date_to": date_to}
+    elif target_date in (None, today) and tokens in (["следующий", "урок"], ["какой", "следующий", "урок"]):
+        result = {"type": "lesson", "date": today.strftime("%d/%m/%Y"), "lesson_number": None}
+    elif target_date is not None:
+        date_str = target_date.strftime("%d/%m/%Y")
+        lesson_number, lesson_rest = extract_lesson_number(tokens)
+        words = set(tokens)
+
+        if lesson_number is not None and set(lesson_rest) <= FILLER_WORDS:
+            result = {"type": "lesson", "date": date_str, "lesson_number": lesson_number}
+        elif words & HOMEWORK_WORDS and words <= HOMEWORK_WORDS | FILLER_WORDS:
+            result = {"type": "get_homework", "date": date_str}
+        elif words <= SCHEDULE_WORDS | FILLER_WORDS and (words & SCHEDULE_WORDS or words & {"что", "у"}):
+            result = {"type": "schedule", "date": date_str}
+
+    if result is not None:
+        stats["handled"] += 1
+    return result
+
+
+def get_stats() -> dict:
+    total = stats["total"]
+    return {**stats, "handled_rate": stats["handled"] / total if total else 0.0}
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+from sqlalchemy import event
+
+from db.core import get_pool_stats
+from db.database import subjects_cache
+from intent_cache import intent_cache
+from intent_rules import get_stats as get_rules_stats
+
+# 0 отключает периодическую сводку в логе
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "300"))
+SLOW_REQUEST_THRESHOLD = float(os.getenv("SLOW_REQUEST_THRESHOLD", "3"))
+
+# ключ из stats() кэша -> метрика Prometheus
+CACHE_METRICS = (
+    ("size", "cache_size", "gauge"),
+    ("hits", "cache_hits_total", "counter"),
+    ("misses", "cache_misses_total", "counter"),
+    ("hit_rate", "cache_hit_rate", "gauge"),
+)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# (имя метрики, метки) -> гистограмма
+histograms = defaultdict(Histogram)
+# стадии текущего апдейта, чтобы разложить его время по интентам
+current_trace = ContextVar("current_trace", default=None)
+
+engine = None
+log_task = None
+
+
+def observe(name: str, value: float, **labels):
+    histograms[(name, tuple(sorted(labels.items())))].observe(value)
+
+
+class span:
+    """Замеряет время стадии: with span("gigachat"): ..."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        record_stage(self.stage, self.elapsed)
+        return False
+
+
+def record_stage(stage: str, elapsed: float):
+    observe("bot_stage_seconds", elapsed, stage=stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace["stages"][stage] += elapsed
+
+
+def set_intent(intent: str):
+    trace = current_trace.get()
+    if trace is not None:
+        trace["intent"] = intent
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внешний middleware: время всего апдейта и его стадий по интентам"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        trace = {"intent": "other", "stages": defaultdict(float)}
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_trace.reset(token)
+
+            intent = trace["intent"]
+            observe("bot_request_seconds", elapsed, intent=intent)
+            for stage, stage_elapsed in trace["stages"].items():
+                observe("bot_request_stage_seconds", stage_elapsed, intent=intent, stage=stage)
+
+            if elapsed >= SLOW_REQUEST_THRESHOLD:
+                stages = " ".join(f"{stage}={value:.3f}s" for stage, value in trace["stages"].items())
+                logging.warning(f"Slow update ({intent}): total={elapsed:.3f}s {stages}")
+
+
+class TelegramRequestMiddleware(BaseRequestMiddleware):
+    """Время вызовов Bot API: отправка ответов, скачивание файлов и т.д."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.metrics_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # фоновые запросы (outbox, очистка FSM) не относятся ни к одному апдейту и не должны размывать стадию db
+    if current_trace.get() is not None:
+        record_stage("db", time.perf_counter() - context.metrics_started)
+
+
+def cache_stats() -> dict:
+    """Кэши процесса по именам для метки cache"""
+    return {"subjects": subjects_cache.stats(), "intents": intent_cache.stats()}
+
+
+def render() -> str:
+    """Метрики в текстовом формате Prometheus"""
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            prefix = f"{label_text}," if label_text else ""
+
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{label_text}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+
+    caches = cache_stats()
+    for key, name, kind in CACHE_METRICS:
+        lines.append(f"# TYPE {name} {kind}")
+        for cache, stats in caches.items():
+            lines.append(f'{name}{{cache="{cache}"}} {stats[key]}')
+
+    # запросы, разобранные правилами без обращения к модели
+    rules = get_rules_stats()
+    lines.append("# TYPE intent_rules_requests_total counter")
+    lines.append(f"intent_rules_requests_total {rules['total']}")
+    lines.append("# TYPE intent_rules_handled_total counter")
+    lines.append(f"intent_rules_handled_total {rules['handled']}")
+    lines.append("# TYPE intent_rules_handled_rate gauge")
+    lines.append(f"intent_rules_handled_rate {rules['handled_rate']}")
+
+    if engine is not None:
+        for key, value in get_pool_stats(engine).items():
+            lines.append(f"# TYPE db_pool_{key} gauge")
+            lines.append(f"db_pool_{key} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+def summary() -> str:
+    parts = []
+    for (metric, labels), histogram in sorted(histograms.items()):
+        if metric != "bot_request_seconds":
+            continue
+        intent = dict(labels)["intent"]
+        parts.append(
+            f"{intent}: n={histogram.count} mean={histogram.sum / histogram.count:.3f}s "
+            f"p50<={histogram.quantile(0.5)}s p95<={histogram.quantile(0.95)}s"
+        )
+    return "; ".join(parts)
+
+
+async def log_summary():
+    while True:
+        await asyncio.sleep(METRICS_LOG_INTERVAL)
+        if histograms:
+            logging.info(f"Request latency: {summary()}")
+
+
+def init_metrics(db_engine):
+    global engine, log_task
+
+    engine = db_engine
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+
+    if METRICS_LOG_INTERVAL > 0:
+        log_task = asyncio.create_task(log_summary())
+
+
+async def close_metrics():
+    global log_task
+
+    if log_task is not None:
+        log_task.cancel()
+        try:
+            await log_task
+        except asyncio.CancelledError:
+            pass
+        log_task = None
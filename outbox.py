@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+from json import dumps, loads
+
+import aio_pika
+
+from db.database import get_unpublished_outbox, mark_outbox_published
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+# на случай, если сообщение записала другая реплика бота
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_RETRY_INTERVAL = float(os.getenv("OUTBOX_RETRY_INTERVAL", "5"))
+
+QUEUES = ["notifications"]
+
+
+class OutboxRelay:
+    """Публикует сообщения из таблицы outbox в RabbitMQ с подтверждениями брокера"""
+
+    def __init__(self, session_maker, url: str):
+        self.session_maker = session_maker
+        self.url = url
+        self.connection = None
+        self.channel = None
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.connection is not None:
+            await self.connection.close()
+
+    def notify(self):
+        self.wakeup.set()
+
+    async def connect(self):
+        self.connection = await aio_pika.connect_robust(self.url)
+        self.channel = await self.connection.channel(publisher_confirms=True)
+        for queue in QUEUES:
+            await self.channel.declare_queue(queue, durable=True)
+        logging.info("RabbitMQ connection established")
+
+    async def publish(self, message) -> None:
+        payload = loads(message.payload)
+        # по этому ключу воркер уведомлений отбрасывает повторную доставку
+        payload["dedup_key"] = f"outbox:{message.id}"
+
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=dumps(payload).encode(),
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                message_id=str(message.id)
+            ),
+            routing_key=message.routing_key
+        )
+
+    async def publish_batch(self) -> int:
+        async with self.session_maker() as session:
+            messages = await get_unpublished_outbox(session, OUTBOX_BATCH_SIZE)
+            if not messages:
+                return 0
+
+            # публикуем пачкой и ждём подтверждения брокера для всех сразу
+            results = await asyncio.gather(
+                *(self.publish(message) for message in messages),
+                return_exceptions=True
+            )
+
+            published = []
+            for message, result in zip(messages, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Failed to publish outbox message {message.id}: {result}")
+                else:
+                    published.append(message.id)
+
+            if published:
+                await mark_outbox_published(session, published)
+            else:
+                await session.rollback()
+
+        logging.info(f"Published {len(published)}/{len(messages)} outbox messages")
+        if len(published) < len(messages):
+            raise ConnectionError("Не все сообщения подтверждены брокером")
+        return len(published)
+
+    async def run(self):
+        while True:
+            try:
+                if self.channel is None:
+                    await self.connect()
+
+                if await self.publish_batch() == OUTBOX_BATCH_SIZE:
+                    continue
+            except Exception as e:
+                logging.error(f"Outbox relay error: {e}")
+                await asyncio.sleep(OUTBOX_RETRY_INTERVAL)
+                continue
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
@@ -1,158 +1,254 @@
 import pandas as pd
 import re
+import zipfile
 from datetime import datetime
+from io import BytesIO
+from itertools import chain
 
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from openpyxl.utils.exceptions import InvalidFileException
 
-def parse_schedule_excel(file_path, class_number):
-    LOAD_LEVELS = {
-        "РОВ": 1,
-        "история": 5,
-        "физика": 8,
-        "англ/инф": 6,
-        "рус.яз": 6,
-        "инф/англ": 6,
-        "алгебра": 9,
-        "родн.яз": 6,
-        "химия": 8,
-        "литер": 6,
-        "географ": 5,
-        "англ.яз": 6,
-        "труд": 4,
-        "физ-ра": 3,
-        "геомет": 9,
-        "биолог": 6,
-        "кл.час": 1,
-        "вер и ст": 7,
-        "профмин": 2,
-        "ОБЗР": 4,
-        "обществ": 5,
-        "---": 0
-    }
-    
-    def clean_cell_value(value):
-        if pd.isna(value) or value in ['---', '----', '-----', '', ' ']:
-            return None
-        return str(value).strip()
-
-    def extract_lesson_info(cell_value):
-        if not cell_value:
-            return None, None
-
-        parts = cell_value.split('\n')
-        
-        if len(parts) >= 2:
-            lesson = parts[0].strip()
-            classroom = parts[1].strip()
-            return lesson, classroom
+LOAD_LEVELS = {
+    "РОВ": 1,
+    "история": 5,
+    "физика": 8,
+    "англ/инф": 6,
+    "рус.яз": 6,
+    "инф/англ": 6,
+    "алгебра": 9,
+    "родн.яз": 6,
+    "химия": 8,
+    "литер": 6,
+    "географ": 5,
+    "англ.яз": 6,
+    "труд": 4,
+    "физ-ра": 3,
+    "геомет": 9,
+    "биолог": 6,
+    "кл.час": 1,
+    "вер и ст": 7,
+    "профмин": 2,
+    "ОБЗР": 4,
+    "обществ": 5,
+    "---": 0
+}
+
+SKIP_SHEETS = {'Лист15'}
+DATE_ROWS = 10
+HEADER_ROWS = 15
+
+
+def clean_cell_value(value):
+    if value is None or value in ['---', '----', '-----', '', ' ']:
+        return None
+    return str(value).strip()
+
+
+def extract_lesson_info(cell_value):
+    if not cell_value:
+        return None, None
+
+    parts = cell_value.split('\n')
+
+    if len(parts) >= 2:
+        lesson = parts[0].strip()
+        classroom = parts[1].strip()
+        return lesson, classroom
+    else:
+        return cell_value, None
+
+
+def get_load_level(lesson_name):
+    if not lesson_name or lesson_name == "---":
+        return 0
+    return LOAD_LEVELS.get(lesson_name, 5)
+
+
+def extract_date_from_rows(rows):
+    for row in rows[:DATE_ROWS]:
+        for cell in row:
+            if isinstance(cell, datetime):
+                return cell.strftime('%d.%m.%Y')
+
+            if cell is None:
+                continue
+            cell_str = str(cell)
+            if 'на' in cell_str.lower() and ('2025' in cell_str or '2024' in cell_str):
+                date_match = re.search(r'(\d{4}[-/]\d{2}[-/]\d{2}|\d{2}\.\d{2}\.\d{4})', cell_str)
+                if date_match:
+                    date_str = date_match.group(1)
+                    try:
+                        if '-' in date_str:
+                            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+                        else:
+                            date_obj = datetime.strptime(date_str, '%d.%m.%Y')
+                        return date_obj.strftime('%d.%m.%Y')
+                    except ValueError:
+                        pass
+
+    return None
+
+
+def find_header_row(rows):
+    for i, row in enumerate(rows[:HEADER_ROWS]):
+        if row and 'класс' in str(row[0]).lower():
+            return i
+    return None
+
+
+def parse_lessons(row):
+    cells = [clean_cell_value(value) for value in row[1:]]
+
+    max_lesson_number = 0
+    for col_idx, cell_value in enumerate(cells, start=1):
+        if cell_value:
+            lesson_name, _ = extract_lesson_info(cell_value)
+            if lesson_name:
+                max_lesson_number = col_idx
+
+    lessons = []
+    for col_idx, cell_value in enumerate(cells[:max_lesson_number], start=1):
+        if cell_value:
+            lesson_name, classroom = extract_lesson_info(cell_value)
+            lessons.append({
+                "lesson": lesson_name if lesson_name else "---",
+                "classroom": classroom if classroom else "",
+                "lesson_number": col_idx,
+                "load_level": get_load_level(lesson_name)
+            })
         else:
-            return cell_value, None
-
-    def get_load_level(lesson_name):
-        if not lesson_name or lesson_name == "---":
-            return 0
-        return LOAD_LEVELS.get(lesson_name, 5)
-
-    def extract_date_from_sheet(df):
-        for i in range(min(10, len(df))):
-            for col in df.columns:
-                cell = df.iloc[i][col]
-
-                if isinstance(cell, datetime):
-                    return cell.strftime('%d.%m.%Y')
-
-                cell_str = str(cell)
-                if 'на' in cell_str.lower() and ('2025' in cell_str or '2024' in cell_str):
-                    date_match = re.search(r'(\d{4}[-/]\d{2}[-/]\d{2}|\d{2}\.\d{2}\.\d{4})', cell_str)
-                    if date_match:
-                        date_str = date_match.group(1)
-                        try:
-                            if '-' in date_str:
-                                date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                            else:
-                                date_obj = datetime.strptime(date_str, '%d.%m.%Y')
-                            return date_obj.strftime('%d.%m.%Y')
-                        except:
-                            pass
-
-        for i in range(min(10, len(df))):
-            for col_idx in range(len(df.columns) - 1):
-                cell = str(df.iloc[i][col_idx])
-                next_cell = df.iloc[i][col_idx + 1]
-                
-                if 'на' in cell.lower() and isinstance(next_cell, datetime):
-                    return next_cell.strftime('%d.%m.%Y')
-        
+            lessons.append({
+                "lesson": "---",
+                "classroom": "",
+                "lesson_number": col_idx,
+                "load_level": 0
+            })
+
+    return lessons
+
+
+def convert_cell(value):
+    # приводим значения к тому виду, в каком их отдаёт pd.read_excel
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in ERROR_CODES:
         return None
+    return value
 
-    excel_file = pd.ExcelFile(file_path)
-    results = []
-    
-    for sheet_name in excel_file.sheet_names:
-        if sheet_name == 'Лист15':
+
+def iter_sheets(source):
+    """Открывает книгу один раз и отдаёт (имя листа, итератор строк) для каждого листа"""
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    try:
+        workbook = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    except (InvalidFileException, zipfile.BadZipFile):
+        # старый формат .xls openpyxl не читает
+        if hasattr(source, "seek"):
+            source.seek(0)
+        excel_file = pd.ExcelFile(source)
+        for sheet_name in excel_file.sheet_names:
+            df = excel_file.parse(sheet_name, header=None)
+            yield sheet_name, (
+                tuple(None if pd.isna(value) else convert_cell(value) for value in row)
+                for row in df.itertuples(index=False)
+            )
+        return
+
+    try:
+        for sheet in workbook.worksheets:
+            sheet.reset_dimensions()
+            yield sheet.title, (
+                tuple(convert_cell(value) for value in row)
+                for row in sheet.iter_rows(values_only=True)
+            )
+    finally:
+        workbook.close()
+
+
+def iter_class_rows(file_path):
+    """Для каждого листа с расписанием отдаёт дату и итератор строк после заголовка 'класс'"""
+    for sheet_name, rows in iter_sheets(file_path):
+        if sheet_name in SKIP_SHEETS:
             continue
 
-        df = pd.read_excel(file_path, sheet_name=sheet_name, header=None)
+        head = []
+        for row in rows:
+            head.append(row)
+            if len(head) == HEADER_ROWS:
+                break
 
-        date = extract_date_from_sheet(df)
+        date = extract_date_from_rows(head)
         if not date:
             print(f"не удалось найти дату на листе '{sheet_name}'")
             continue
 
-        header_row = None
-        for i in range(min(15, len(df))):
-            if 'класс' in str(df.iloc[i][0]).lower():
-                header_row = i
-                break
-        
+        header_row = find_header_row(head)
         if header_row is None:
             print(f"не удалось найти строку 'класс' на листе '{sheet_name}'")
             continue
 
+        yield date, chain(head[header_row + 1:], rows)
+
+
+def parse_schedule_excel(file_path, class_number):
+    results = []
+
+    for date, rows in iter_class_rows(file_path):
+        # дочитываем лист только до строки нужного класса
         class_row = None
-        for i in range(header_row + 1, len(df)):
-            cell_value = clean_cell_value(df.iloc[i][0])
+        for row in rows:
+            cell_value = clean_cell_value(row[0]) if row else None
             if cell_value and class_number in cell_value:
-                class_row = i
+                class_row = row
                 break
 
         if class_row is None:
             continue
 
-        lessons = []
-        max_lesson_number = 0
+        lessons = parse_lessons(class_row)
+        if lessons:
+            results.append({
+                "date": date,
+                "lessons": lessons
+            })
+
+    return results
 
-        for col_idx in range(1, len(df.columns)):
-            cell_value = clean_cell_value(df.iloc[class_row][col_idx])
 
+def parse_school_excel(file_path):
+    """Разбирает расписание всех классов за один проход по книге"""
+    sheets = []
+
+    for date, rows in iter_class_rows(file_path):
+        classes = []
+        for row in rows:
+            cell_value = clean_cell_value(row[0]) if row else None
             if cell_value:
-                lesson_name, classroom = extract_lesson_info(cell_value)
-                if lesson_name:
-                    max_lesson_number = max(max_lesson_number, col_idx)
+                classes.append((cell_value, parse_lessons(row)))
+        sheets.append({
+            "date": date,
+            "classes": classes
+        })
 
-        for col_idx in range(1, max_lesson_number + 1):
-            cell_value = clean_cell_value(df.iloc[class_row][col_idx])
+    return sheets
 
-            if cell_value:
-                lesson_name, classroom = extract_lesson_info(cell_value)
-                lessons.append({
-                    "lesson": lesson_name if lesson_name else "---",
-                    "classroom": classroom if classroom else "",
-                    "lesson_number": col_idx,
-                    "load_level": get_load_level(lesson_name)
-                })
-            else:
-                lessons.append({
-                    "lesson": "---",
-                    "classroom": "",
-                    "lesson_number": col_idx,
-                    "load_level": 0
-                })
 
-        if lessons:
-            results.append({
-                "date": date,
-                "lessons": lessons
-            })
+def select_class(sheets, class_number):
+    """Достаёт из результата parse_school_excel то же, что вернул бы parse_schedule_excel"""
+    results = []
+
+    for sheet in sheets:
+        for class_name, lessons in sheet["classes"]:
+            if class_number in class_name:
+                if lessons:
+                    results.append({
+                        "date": sheet["date"],
+                        "lessons": lessons
+                    })
+                break
 
     return results
 
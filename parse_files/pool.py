@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from parse_files.parse_excel import parse_school_excel, select_class
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+# сколько загрузок может ждать свободного процесса, остальным отказываем
+PARSE_QUEUE_SIZE = int(os.getenv("PARSE_QUEUE_SIZE", "20"))
+# сколько разобранных книг держать в памяти, обычно это файлы разных школ за неделю
+SCHOOL_CACHE_SIZE = int(os.getenv("SCHOOL_CACHE_SIZE", "32"))
+
+
+class ParseQueueFull(Exception):
+    pass
+
+
+executor = None
+admission = None
+school_cache = OrderedDict()
+in_flight = {}
+
+
+def init_parse_pool():
+    global executor, admission
+
+    executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    admission = asyncio.Semaphore(PARSE_WORKERS + PARSE_QUEUE_SIZE)
+
+
+def close_parse_pool():
+    global executor
+
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+def store_school(content_hash: str, future: asyncio.Future):
+    del in_flight[content_hash]
+    if future.cancelled() or future.exception() is not None:
+        return
+
+    school_cache[content_hash] = future.result()
+    while len(school_cache) > SCHOOL_CACHE_SIZE:
+        school_cache.popitem(last=False)
+
+
+async def parse_school(content: bytes) -> list:
+    if executor is None:
+        init_parse_pool()
+
+    content_hash = hashlib.sha256(content).hexdigest()
+    if content_hash in school_cache:
+        school_cache.move_to_end(content_hash)
+        return school_cache[content_hash]
+
+    # ту же книгу уже разбирают для другого ученика - ждём этот разбор
+    if content_hash in in_flight:
+        return await asyncio.shield(in_flight[content_hash])
+
+    if admission.locked():
+        raise ParseQueueFull("Очередь разбора расписаний переполнена")
+
+    async with admission:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, parse_school_excel, content)
+        in_flight[content_hash] = future
+        future.add_done_callback(lambda f: store_school(content_hash, f))
+        return await asyncio.shield(future)
+
+
+async def parse_schedule(content: bytes, class_number: str) -> list:
+    return select_class(await parse_school(content), class_number)
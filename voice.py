@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import speech_recognition as sr
+from pydub import AudioSegment
+
+from db.cache import TTLCache
+from metrics import span
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", "4"))
+# папка с распакованной моделью vosk для офлайн-распознавания, например vosk-model-small-ru
+# с https://alphacephei.com/vosk/models; без неё распознаёт веб-сервис Google, как раньше
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH")
+VOICE_BACKEND = os.getenv("VOICE_BACKEND", "vosk" if VOSK_MODEL_PATH else "google")
+
+transcripts_cache = TTLCache(
+    max_size=int(os.getenv("TRANSCRIPTS_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("TRANSCRIPTS_CACHE_TTL", "86400")),
+)
+
+
+class RecognitionError(Exception):
+    pass
+
+
+class RecognizerBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def recognize(self, pcm: bytes) -> str:
+        """Принимает 16 кГц моно 16-бит PCM и возвращает текст"""
+
+
+class GoogleRecognizer(RecognizerBackend):
+    name = "google"
+
+    def __init__(self, language: str = "ru-RU"):
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def recognize(self, pcm: bytes) -> str:
+        audio_data = sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return self.recognizer.recognize_google(audio_data, language=self.language)
+        except (sr.UnknownValueError, sr.RequestError) as e:
+            raise RecognitionError(str(e))
+
+
+class VoskRecognizer(RecognizerBackend):
+    name = "vosk"
+
+    def __init__(self, model_path: str):
+        # vosk нужен только для офлайн-распознавания, поэтому импортируем его здесь
+        from vosk import KaldiRecognizer, Model, SetLogLevel
+
+        SetLogLevel(-1)
+        self.model = Model(model_path)
+        self.recognizer_class = KaldiRecognizer
+
+    def recognize(self, pcm: bytes) -> str:
+        recognizer = self.recognizer_class(self.model, SAMPLE_RATE)
+        recognizer.AcceptWaveform(pcm)
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        if not text:
+            raise RecognitionError("Пустой результат распознавания")
+        return text
+
+
+def create_backend(name: str) -> RecognizerBackend:
+    if name == "vosk":
+        return VoskRecognizer(VOSK_MODEL_PATH)
+    if name == "google":
+        return GoogleRecognizer()
+    raise ValueError(f"Неизвестный движок распознавания: {name}")
+
+
+def decode_voice(content: bytes) -> bytes:
+    audio = AudioSegment.from_file(BytesIO(content), format="ogg")
+    audio = audio.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(SAMPLE_WIDTH)
+    return audio.raw_data
+
+
+backend = None
+executor = None
+
+
+def init_voice():
+    global backend, executor
+
+    backend = create_backend(VOICE_BACKEND)
+    executor = ThreadPoolExecutor(max_workers=VOICE_WORKERS, thread_name_prefix="voice")
+
+
+def close_voice():
+    global executor
+
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+async def transcribe(bot, voice) -> str:
+    if executor is None:
+        init_voice()
+
+    cached = transcripts_cache.get(voice.file_unique_id)
+    if cached is not None:
+        return cached
+
+    loop = asyncio.get_running_loop()
+
+    with span("voice.download") as download:
+        file = await bot.get_file(voice.file_id)
+        content = await bot.download_file(file.file_path)
+
+    with span("voice.decode") as decode:
+        pcm = await loop.run_in_executor(executor, decode_voice, content.getvalue())
+
+    with span("voice.recognize") as recognize:
+        text = await loop.run_in_executor(executor, backend.recognize, pcm)
+
+    logging.info(
+        f"Voice {voice.file_unique_id} ({voice.duration}s, {backend.name}): "
+        f"download={download.elapsed:.3f}s decode={decode.elapsed:.3f}s "
+        f"recognize={recognize.elapsed:.3f}s"
+    )
+
+    transcripts_cache.set(voice.file_unique_id, text)
+    return text